@@ -18,36 +18,58 @@
 Driver for servers running replicated volumes.
 """
 
+import copy
 import os
+import signal
+import socket
+import socketserver
 import threading
+import time
+import uuid
 
 import six
 import json
+import collections
 import fnmatch
+import glob
 import requests
 import datetime
 import hmac
 import hashlib
 
+from concurrent import futures
 from oslo_concurrency import processutils
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import units
 from threading import Thread
 
 from cinder.i18n import _
+from cinder import context as cinder_context
 from cinder import interface
 from cinder import utils
 from cinder import exception
 from cinder import coordination
+from cinder import objects
 from cinder.objects import fields
+from cinder.image import image_utils
 from cinder.volume.drivers.lvm import LVMVolumeDriver
+from cinder.volume import throttling
+from cinder.volume import volume_utils
 from webob import Request, Response
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, WSGIServer
 
 # import cinder.volume.drivers.ovt.
 from cinder.volume.drivers.ovt.resources import REPLICATION_PROTOCOLS, RESOURCE_CONF, BACKEND
-from cinder.volume.drivers.ovt.resources import HTTP_HEADER_X_EV3_DATE, HTTP_HEADER_X_EV3_TOKEN
+from cinder.volume.drivers.ovt.resources import MESH_RESOURCE_CONF, MESH_HOST, MESH_CONNECTION
+from cinder.volume.drivers.ovt.resources import MESH_PATHS_CONNECTION, MESH_PATH
+from cinder.volume.drivers.ovt.resources import SECTION, SECTION_OPTION, CONNECTION_OPTION
+from cinder.volume.drivers.ovt.resources import HTTP_HEADER_X_EV3_DATE, HTTP_HEADER_X_EV3_TOKEN, HTTP_HEADER_X_EV3_JOB_ID
+from cinder.volume.drivers.ovt.resources import HTTP_HEADER_X_EV3_IDEMPOTENCY_KEY
+from cinder.volume.drivers.ovt.idempotency import IdempotencyCache
+from cinder.volume.drivers.ovt.jobs import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_ERROR
+from cinder.volume.drivers.ovt.profiler import SamplingProfiler, PROFILE_DIR, TIMERS, timed
 from cinder.volume.drivers.ovt.signature import AbstractSignerForAuthorizationHeader
 
 LOG = logging.getLogger(__name__)
@@ -74,11 +96,212 @@ replication_opts = [
     cfg.IntOpt('replication_resync_rate',
                default=100,
                help='The bandwidth for replication.'),
+    cfg.IntOpt('replication_link_port_offset',
+               default=5000,
+               help='The port offset between connections of a replicated resource rendered as a connection mesh. '
+                    'Connection N of a resource with device minor M uses the port '
+                    'replication_starting_port + N * replication_link_port_offset + M. Further network paths '
+                    'configured by the paths entry of replication_device use the port ranges after the ranges of '
+                    'all connections. The offset must be greater than the device minors, resources with a larger '
+                    'minor can\'t be rendered as a mesh.'),
+    cfg.StrOpt('replication_path_transport',
+               default='lb-tcp',
+               help='DRBD transport of connections with several network paths, the load balancing transport '
+                    'spreads the replication traffic over all paths. An empty value keeps the tcp transport that '
+                    'uses one path at a time.'),
+    cfg.BoolOpt('replication_buffer_autotune',
+                default=False,
+                help='Sizes sndbuf-size, rcvbuf-size, max-buffers and max-epoch-size of every link from the '
+                     'bandwidth-delay product measured by tcp connect round trips and the data sent by drbd. '
+                     'Net options set by the replication_device entry are kept.'),
+    cfg.IntOpt('replication_buffer_autotune_interval',
+               default=300,
+               help='Seconds between measurements of the bandwidth-delay product of the links.'),
+    cfg.IntOpt('replication_buffer_autotune_samples',
+               default=3,
+               help='Number of consecutive measurements that must ask for smaller buffers before they are shrunk, '
+                    'bigger buffers are applied at once.'),
+    cfg.IntOpt('replication_buffer_min_size',
+               default=1048576,
+               max=10485760,
+               help='Minimum socket buffer size in bytes applied by the buffer autotuning.'),
+    cfg.IntOpt('replication_buffer_max_size',
+               default=10485760,
+               max=10485760,
+               help='Maximum socket buffer size in bytes applied by the buffer autotuning, drbd accepts at most '
+                    '10 MiB.'),
+    cfg.BoolOpt('replication_fast_delete',
+                default=False,
+                help='delete_volume only hands the resource over to a background reaper that tears down drbd '
+                     'resources and removes logical volumes locally and on secondary backends in batches, and '
+                     'retries until everything is removed.'),
+    cfg.IntOpt('replication_reaper_interval',
+               default=10,
+               help='Seconds between runs of the background reaper of deleted volumes.'),
+    cfg.IntOpt('replication_clear_bps_limit',
+               default=0,
+               help='Write bandwidth in bytes per second of one wipe of a deleted logical volume. 0 uses '
+                    'volume_copy_bps_limit.'),
+    cfg.IntOpt('replication_clear_concurrency',
+               default=2,
+               help='Maximum number of logical volumes wiped at the same time on this backend.'),
+    cfg.ListOpt('replication_warm_pool',
+                default=[],
+                help='Pre-provisioned replicated resources as type:size:count entries, e.g. ssd:10:20,ssd:20:5. '
+                     'The type is the name or the id of the volume type, the size is in GiB. create_volume binds '
+                     'a matching resource from the pool instead of creating one, the pool is refilled in the '
+                     'background.'),
+    cfg.IntOpt('replication_warm_pool_interval',
+               default=30,
+               help='Seconds between refills of the warm pool.'),
+    cfg.IntOpt('replication_peer_status_ttl',
+               default=60,
+               help='Seconds the capacity and health reported by the heartbeat of a secondary backend are cached. '
+                    'The published free capacity of the pools is the minimum of this and all secondary backends.'),
+    cfg.BoolOpt('replication_peer_unreachable_no_capacity',
+                default=False,
+                help='The pools report no free capacity while a secondary backend is unreachable, so the scheduler '
+                     'places no volumes that can\'t be replicated. By default an unreachable backend doesn\'t '
+                     'limit the capacity.'),
+    cfg.IntOpt('replication_stats_cache_ttl',
+               default=300,
+               help='Seconds between full rescans of the volume group capacity. In between the cached capacity is '
+                    'adjusted incrementally when the driver creates, extends or deletes logical volumes. '
+                    '0 rescans the volume group on every stats update.'),
+    cfg.BoolOpt('replication_adaptive_protocol',
+                default=False,
+                help='Temporarily switches full-sync links of congested volumes to async and back once the link '
+                     'recovers and the replica is in sync.'),
+    cfg.IntOpt('replication_adaptive_interval',
+               default=10,
+               help='Seconds between samples of the peer latency and pending writes.'),
+    cfg.FloatOpt('replication_adaptive_latency_threshold',
+                 default=20.0,
+                 help='Peer round trip time in milliseconds above which a link is considered congested.'),
+    cfg.IntOpt('replication_adaptive_pending_threshold',
+               default=64,
+               help='Number of pending and unacknowledged requests of a link above which it is considered congested.'),
+    cfg.FloatOpt('replication_adaptive_restore_ratio',
+                 default=0.5,
+                 help='Fraction of the latency and pending thresholds below which a switched link is considered '
+                      'recovered.'),
+    cfg.IntOpt('replication_adaptive_switch_samples',
+               default=3,
+               help='Number of consecutive congested samples before a link is switched to async.'),
+    cfg.IntOpt('replication_adaptive_restore_samples',
+               default=6,
+               help='Number of consecutive recovered samples before a link is switched back to full-sync.'),
+    cfg.IntOpt('replication_bulk_batch_size',
+               default=64,
+               help='Number of drbd resources or logical volumes handled by one command in bulk operations.'),
+    cfg.IntOpt('replication_bulk_workers',
+               default=8,
+               help='Maximum number of bulk operation batches or exports processed in parallel.'),
+    cfg.IntOpt('replication_job_workers',
+               default=4,
+               help='Number of worker threads running volume operations requested by other backends.'),
+    cfg.IntOpt('replication_job_ttl',
+               default=3600,
+               help='Seconds the status of a finished job is kept for polling and retried requests.'),
+    cfg.IntOpt('replication_job_poll_timeout',
+               default=30,
+               help='Seconds a job status request is held open until the job is finished.'),
+    cfg.IntOpt('replication_job_timeout',
+               default=3600,
+               help='Seconds to wait for a volume operation requested from other backends.'),
+    cfg.IntOpt('replication_idempotency_cache_size',
+               default=1024,
+               help='Maximum number of completed responses kept to answer retried requests of other backends.'),
+    cfg.IntOpt('replication_idempotency_cache_ttl',
+               default=900,
+               help='Seconds a completed response is kept to answer retried requests of other backends.'),
+    cfg.IntOpt('replication_rs_discard_granularity',
+               default=65536,
+               help='Resync discard granularity in bytes for thin logical volumes. Zeroed blocks are discarded on '
+                    'the resync target instead of being transferred; should match the thin pool chunk size. '
+                    '0 disables discard-based zero detection.'),
+    cfg.IntOpt('replication_resync_sample_interval',
+               default=10,
+               help='Seconds between samples of resync progress used to measure the data skipped by discard-based '
+                    'zero detection. 0 disables the measurement.'),
+    cfg.IntOpt('replication_image_copy_sparse_size',
+               default=1048576,
+               help='Size in bytes of the zeroed ranges that are not written when an image is copied to a '
+                    'replicated volume, they are discarded or skipped. 0 copies images without zero detection.'),
+    cfg.IntOpt('replication_verify_period',
+               default=0,
+               help='Seconds between online verifications of each replicated volume. 0 disables the verification '
+                    'scheduler.'),
+    cfg.IntOpt('replication_verify_interval',
+               default=60,
+               help='Seconds between runs of the verification scheduler.'),
+    cfg.StrOpt('replication_verify_alg',
+               default='crc32c',
+               help='Default checksum algorithm of the online verification, the volume type extra spec '
+                    'ovt_ev3:verify_alg overrides it.'),
+    cfg.IntOpt('replication_verify_max_rate',
+               default=102400,
+               help='Bandwidth in KiB/s shared by all running online verifications.'),
+    cfg.IntOpt('replication_verify_concurrency',
+               default=2,
+               help='Maximum number of online verifications running at the same time.'),
+    cfg.BoolOpt('replication_verify_auto_resync',
+                default=False,
+                help='Resyncs the blocks found out of sync by the online verification.'),
+    cfg.IntOpt('replication_multipath_fence_interval',
+               default=10,
+               help='Seconds between checks that remove exports of secondary backends from dual-primary volumes '
+                    'whose replication link is lost. The check only cleans up the exports, the writes are fenced '
+                    'by drbd.'),
+    cfg.StrOpt('replication_multipath_fence_peer',
+               default=None,
+               help='Fence-peer handler of dual-primary volumes with two backends, '
+                    'e.g. /usr/lib/drbd/crm-fence-peer.9.sh. drbd freezes I/O when the replication link is lost '
+                    'until the handler has fenced the peer. Without a handler both backends freeze I/O when the '
+                    'link is lost, because two backends have no quorum on their own.'),
+    cfg.BoolOpt('replication_consistent_snapshots',
+                default=False,
+                help='Suspends the writes to a volume while its snapshot is taken on all backends, so the snapshots '
+                     'are identical and a revert needs no full resync. Writes are suspended only while all links '
+                     'are connected and up to date.'),
+    cfg.IntOpt('replication_snapshot_suspend_timeout',
+               default=5,
+               help='Seconds the secondary backends get to take the snapshot while the writes are suspended, a '
+                    'backend that takes longer is not retried and the snapshot is not consistent.'),
+    cfg.BoolOpt('replication_backup_from_secondary',
+                default=False,
+                help='Backups of in-use volumes are taken from a temporary snapshot created on an up to date '
+                     'secondary backend and exported by it, so the backup doesn\'t read from the primary. Cinder '
+                     'creates no temporary snapshot for available volumes, their backups still read from the '
+                     'primary.'),
+    cfg.StrOpt('replication_profiler_signal',
+               default='SIGUSR1',
+               help='Signal that starts the sampling profiler of the driver and the storage agent. An empty value '
+                    'disables the signal, the profiler can still be started by POST /admin/profile.'),
+    cfg.IntOpt('replication_profiler_duration',
+               default=30,
+               help='Default seconds of one sampling profiler session.'),
+    cfg.FloatOpt('replication_profiler_interval',
+                 default=0.01,
+                 help='Seconds between stack samples of the sampling profiler.'),
 ]
 CONF = cfg.CONF
 CONF.register_opts(replication_opts)
 
 RESOURCE_META = 'ev3_meta'
+# resources of deleted volumes that are waiting for the reaper
+RESOURCE_DELETING = 'ev3_deleting'
+# pre-provisioned resources of the warm pool
+RESOURCE_POOL = 'ev3_pool'
+# replication_device keys that turn the resource into a DRBD 9 connection mesh
+LINK_SETTINGS = ('replication_mode', 'replication_port', 'paths')
+LINK_NET_OPTION_PREFIX = 'net_'
+# volume type extra specs that can be changed by retype without moving data
+REPLICATION_SPECS = ('ovt_ev3:replication_mode', 'ovt_ev3:verify_alg')
+# the largest sndbuf-size and rcvbuf-size accepted by drbd
+DRBD_MAX_SOCKET_BUFFER_SIZE = 10485760
+# configfs of the LIO target
+LIO_CONFIGFS = '/sys/kernel/config/target'
 
 class ReplicatedVolumeBackendAPIException(exception.VolumeBackendAPIException):
     message = _("Bad or unexpected response from the replicated volume backend API: %(data)s")
@@ -103,6 +326,39 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         super(ReplicatedVolumeDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(replication_opts)
         self.signature = EV3SignerForAuthorizationHeader(self.configuration.replication_internal_secret)
+        self._stats_lock = threading.Lock()
+        self._stats_refreshed_at = None
+        self._adaptive_samples = {}
+        self._restored_exports = {}
+        self._link_traffic = {}
+        self._link_buffers = {}
+        self._peer_status = {}
+        self._peer_status_lock = threading.Lock()
+        self._backup_device = threading.local()
+        self._pool_lock = threading.Lock()
+        self._clear_slots = threading.BoundedSemaphore(max(self.configuration.replication_clear_concurrency, 1))
+        self._clear_throttle = None
+        if self.configuration.replication_clear_bps_limit > 0:
+            self._clear_throttle = throttling.BlkioCgroup(self.configuration.replication_clear_bps_limit,
+                                                          'cinder-volume-ev3-clear')
+        self._reserved_minors = set()
+        self._resyncs = {}
+        self._verifying = set()
+        self._portal_connections = collections.Counter()
+        self._connection_portals = {}
+        self._portal_lock = threading.Lock()
+        self._multipath_exports = set()
+        self._multipath_fencing = False
+        self._multipath_lock = threading.Lock()
+        self._verify_findings = None
+        self._resync_total_kb = 0
+        self._resync_skipped_kb = 0
+        self._jobs = None
+        self._profiler = SamplingProfiler(output_dir=f"{CONF.get('state_path')}/{PROFILE_DIR}",
+                                          interval=self.configuration.replication_profiler_interval)
+        self._idempotency = IdempotencyCache(size=self.configuration.replication_idempotency_cache_size,
+                                             ttl=self.configuration.replication_idempotency_cache_ttl)
+        self._protocol_switch_events = collections.deque(maxlen=100)
 
 
     def _init_vendor_properties(self):
@@ -114,19 +370,35 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             _("Specifies replication mode."),
             "string",
             enum=['async', 'semi-sync', 'full-sync'])
+        self._set_property(
+            properties,
+            "ovt_ev3:verify_alg",
+            "Verification algorithm",
+            _("Specifies the checksum algorithm of the online verification."),
+            "string",
+            enum=['crc32c', 'md5', 'sha1', 'sha256'])
+        self._set_property(
+            properties,
+            "ovt_ev3:multipath_export",
+            "Multipath export",
+            _("Exports full-sync volumes from the primary and the secondary backends as dual-primary "
+              "resources, so multipath initiators spread I/O across all storage nodes."),
+            "boolean")
         return properties, 'ovt_ev3'
 
 
     def check_for_setup_error(self):
         super().check_for_setup_error()
-        resource_meta_dir = f"{CONF.get('state_path')}/{RESOURCE_META}"
-        if not os.path.exists(resource_meta_dir):
-            try:
-                os.makedirs(resource_meta_dir)
-            except FileExistsError:
-                LOG.info(f"directory {resource_meta_dir} already exist.")
-            except OSError as e:
-                LOG.error(f"Error creating {resource_meta_dir}: {e}")
+        for resource_meta_dir in (f"{CONF.get('state_path')}/{RESOURCE_META}",
+                                  f"{CONF.get('state_path')}/{RESOURCE_DELETING}",
+                                  f"{CONF.get('state_path')}/{RESOURCE_POOL}"):
+            if not os.path.exists(resource_meta_dir):
+                try:
+                    os.makedirs(resource_meta_dir)
+                except FileExistsError:
+                    LOG.info(f"directory {resource_meta_dir} already exist.")
+                except OSError as e:
+                    LOG.error(f"Error creating {resource_meta_dir}: {e}")
 
         if self.configuration.backend_ip is None:
             LOG.warning("The backend_ip value is not specified. Data replication will not be available.")
@@ -143,51 +415,439 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         if self.configuration.replication_internal_secret is None:
             LOG.warning("The replication_internal_secret value is not specified. Failed to initialize replicated volume driver correctly.")
 
+        for replication_device in self.configuration.replication_device or []:
+            replication_mode = replication_device.get('replication_mode')
+            if replication_mode is not None and replication_mode not in REPLICATION_PROTOCOLS:
+                raise exception.InvalidConfigurationValue(option='replication_device:replication_mode',
+                                                          value=replication_mode)
+            if 'paths' in replication_device:
+                self.__parse_paths(replication_device['paths'])
+
         self.listen()
 
+        if self.configuration.replication_adaptive_protocol:
+            self.__run_periodically(self.__adapt_replication_protocols,
+                                    self.configuration.replication_adaptive_interval)
+
+        if self.__is_discard_resync() and self.configuration.replication_resync_sample_interval > 0:
+            self.__run_periodically(self.__sample_resyncs, self.configuration.replication_resync_sample_interval)
+
+        if self.configuration.replication_verify_period > 0:
+            self.__run_periodically(self.__schedule_verifications, self.configuration.replication_verify_interval)
+
+        self._multipath_exports = {r['volume_id'] for r in self.__list_resources() if r.get('multipath_exported')}
+        if self._multipath_exports:
+            self.__start_multipath_fencing()
+
+        pool = self.__get_warm_pool_config()
+        if (self.configuration.replication_fast_delete or pool or
+                os.listdir(f"{CONF.get('state_path')}/{RESOURCE_DELETING}")):
+            # the reaper also removes the resources that were dropped from the warm pool
+            self.__run_periodically(self.__reap_deleted_resources, self.configuration.replication_reaper_interval)
+
+        if pool or os.listdir(f"{CONF.get('state_path')}/{RESOURCE_POOL}"):
+            self.__run_periodically(self.__refill_warm_pool, self.configuration.replication_warm_pool_interval)
+
+        if self.configuration.replication_buffer_autotune:
+            self.__run_periodically(self.__tune_link_buffers, self.configuration.replication_buffer_autotune_interval)
+
+        if self.configuration.replication_profiler_signal:
+            self.__install_profiler_signal(self.configuration.replication_profiler_signal)
+
 
+    def __install_profiler_signal(self, signal_name):
+        """
+        Starts the sampling profiler for the configured duration on the signal
+        :param signal_name: the signal name, e.g. SIGUSR1
+        :return: None
+        """
+        signum = getattr(signal, signal_name, None)
+        if not isinstance(signum, signal.Signals):
+            raise exception.InvalidConfigurationValue(option='replication_profiler_signal', value=signal_name)
+        try:
+            # the handler only starts a thread, the profiler is started and logged outside of the signal handler
+            signal.signal(signum, lambda *args: Thread(target=self.__start_profiler,
+                                                      args=(self.configuration.replication_profiler_duration,)).start())
+            LOG.info(f"The sampling profiler is started by {signal_name}")
+        except ValueError as e:
+            # signal handlers can be installed by the main thread only
+            LOG.warning(f"The sampling profiler signal {signal_name} was not installed: {e}")
+
+
+    def __start_profiler(self, duration):
+        """
+        Starts a session of the sampling profiler
+        :param duration: duration in seconds
+        :return: path of the folded stacks file or None if a session is already running
+        """
+        path = self._profiler.start(duration)
+        if path is None:
+            LOG.warning("The sampling profiler is already running")
+        else:
+            LOG.info(f"Sampling profiler started for {duration}s, the stacks are written to {path}")
+        return path
+
+
+    @timed
     def create_volume(self, volume):
-        super().create_volume(volume)
-        return self.setup_replication(volume)
+        """
+        Creates the volume, a pre-provisioned resource of the warm pool is bound to the volume if there is one
+        :param volume: the volume object
+        :return: model update
+        """
+        pooled = self.__claim_pooled_resource(volume)
+        if pooled is not None:
+            model_update = self.__bind_pooled_resource(pooled, volume)
+            if model_update is not None:
+                return model_update
+        return self.__create_replicated_volume(volume)
+
+
+    def __create_replicated_volume(self, volume):
+        """
+        Creates the local logical volume while secondary backends create their replicas, the drbd resource is
+        started when both sides are done
+        :param volume: the volume object
+        :return: model update
+        """
+        resource = self.__get_resource(volume)
+        # new thin volumes read as zeroes on all backends and their bitmap is cleared
+        resource['zeroed'] = self.configuration.lvm_type == 'thin'
+        try:
+            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                remote = executor.submit(self.__create_remote_replicas, resource)
+                try:
+                    super().create_volume(volume)
+                except Exception:
+                    if remote.result() != fields.ReplicationStatus.DISABLED:
+                        LOG.warning(f"The volume {volume['name']} was not created, removing its remote replicas")
+                        self.delete_replication(volume)
+                    raise
+            self.__account_capacity(volume['size'], volumes=1)
+            return self.__setup_local_replication(resource, remote.result())
+        finally:
+            self._reserved_minors.discard(resource['device_minor'])
+
+
+    def create_cloned_volume(self, volume, src_vref):
+        """
+        Creates a clone of the volume and accounts its capacity
+        :param volume: the volume object
+        :param src_vref: the source volume object
+        :return: model update
+        """
+        model_update = super().create_cloned_volume(volume, src_vref)
+        self.__account_capacity(volume['size'], volumes=1)
+        return model_update
+
+
+    def create_volume_from_snapshot(self, volume, snapshot):
+        """
+        Creates the volume from the snapshot and accounts its capacity
+        :param volume: the volume object
+        :param snapshot: the snapshot object
+        :return: model update
+        """
+        model_update = super().create_volume_from_snapshot(volume, snapshot)
+        self.__account_capacity(volume['size'], volumes=1)
+        return model_update
 
 
+    @timed
     def delete_volume(self, volume):
-        self.delete_replication(volume)
-        super().delete_volume(volume)
+        resource = self.__load_resource_meta(volume['id'])
+        if self.configuration.replication_fast_delete and resource is not None:
+            if self.vg.lv_has_snapshot(volume['name']):
+                LOG.error('Unable to delete due to existing snapshot for volume: %s', volume['name'])
+                raise exception.VolumeIsBusy(volume_name=volume['name'])
+            # the resource is no longer seen by other tasks, the reaper removes it
+            with open(self.__get_deleting_resource_path(volume['id']), "w") as file:
+                json.dump(resource, file, indent=4)
+            # the capacity is released by the reaper when the logical volume is removed
+            self.__delete_resource_meta(resource)
+            LOG.info(f"The volume {volume['id']} was handed over to the reaper")
+            return
+
+        # the local drbd resource is stopped first, so the wipe of the logical volume is not replicated
+        self.__remove_drbd_config({'volume_id': volume['id']})
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            remote = executor.submit(self.delete_replication, volume)
+            try:
+                super().delete_volume(volume)
+            finally:
+                remote.result()
+        self.__account_capacity(-volume['size'], volumes=-1)
 
 
+    @timed
     def extend_volume(self, volume, new_size):
-        super().extend_volume(volume, new_size)
+        """
+        Extends the local logical volume while secondary backends extend their replicas, the drbd resource is
+        resized when both sides are done
+        :param volume: the volume object
+        :param new_size: the new size
+        :return: None
+        """
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            remote = executor.submit(self.extend_replicated_volume, volume, new_size)
+            try:
+                super().extend_volume(volume, new_size)
+            finally:
+                # the remote replica is joined in any case, a bigger replica doesn't harm the resource
+                extended = remote.result()
+        self.__account_capacity(new_size - volume['size'])
+        self.__update_resource_meta_size(volume['id'], new_size)
         self.__set_drbd_resource_primary(resource_id=volume.id, force=True)
-        if self.extend_replicated_volume(volume, new_size):
+        if extended:
             LOG.info(f"Remote replica of volume {volume.id} has been successfully extended up to {new_size}G")
         else:
             LOG.warning(f"Remote replica of volume {volume.id} didn't extended up to {new_size}G")
         self.__resize_drbd_resource(volume.id, new_size)
 
+    @timed
     def create_snapshot(self, snapshot):
-        super().create_snapshot(snapshot)
+        volume_id = snapshot.get('volume_id')
+        if volume_id is None:
+            # the temporary snapshot of a thick clone is a plain dict and exists on the current backend only
+            return super().create_snapshot(snapshot)
+
+        if self.__is_backup_snapshot(snapshot):
+            model_update = self.__create_secondary_snapshot(snapshot)
+            if model_update is not None:
+                return model_update
+
+        resource = self.__load_resource_meta(volume_id)
+        resource_status = next(iter(self.__get_drbd_status(volume_id)), None) if resource is not None else None
+        fenced = False
+        timeout = None
+        if (self.configuration.replication_consistent_snapshots and resource_status is not None and
+                resource_status.get('role') == 'Primary' and
+                self.__is_snapshot_consistent(resource, resource_status, True)):
+            # writes are suspended, so the snapshots of all backends contain the same data, the secondary
+            # backends get one short attempt so the writes are not suspended for long
+            fenced = self.__suspend_io(volume_id)
+            timeout = self.configuration.replication_snapshot_suspend_timeout if fenced else None
+        try:
+            created = self.__create_snapshots(snapshot, timeout)
+        finally:
+            if fenced:
+                self.__resume_io(volume_id)
+
+        if (created and resource_status is not None and
+                self.__is_snapshot_consistent(resource, resource_status, fenced)):
+            consistent_snapshots = resource.setdefault('consistent_snapshots', [])
+            if snapshot['name'] not in consistent_snapshots:
+                consistent_snapshots.append(snapshot['name'])
+            self.__save_resource_meta(resource)
+
+
+    def __create_snapshots(self, snapshot, timeout=None):
+        """
+        Creates the snapshot on the current and all secondary backends
+        :param snapshot: the snapshot object
+        :param timeout: the timeout in seconds of a single attempt on the secondary backends, which take the
+        snapshot in parallel, the requests are retried one by one if not specified
+        :return: true if the snapshot was created on all secondary backends
+        """
         snapshot_info = {
             'name': snapshot['name'],
             'volume_name': snapshot['volume_name'],
         }
-        for secondary_backend in self.configuration.replication_device:
+        if timeout is None:
+            super().create_snapshot(snapshot)
+            return all([self.__create_secondary_snapshot_replica(b, snapshot, snapshot_info)
+                        for b in self.configuration.replication_device])
+
+        with futures.ThreadPoolExecutor(max_workers=max(len(self.configuration.replication_device), 1)) as executor:
+            remote = [executor.submit(self.__create_secondary_snapshot_replica, b, snapshot, snapshot_info, timeout)
+                      for b in self.configuration.replication_device]
+            super().create_snapshot(snapshot)
+            return all([f.result() for f in remote])
+
+
+    def __create_secondary_snapshot_replica(self, secondary_backend, snapshot, snapshot_info, timeout=None) -> bool:
+        """
+        Creates the snapshot on the secondary backend
+        :param secondary_backend: the replication_device entry
+        :param snapshot: the snapshot object
+        :param snapshot_info: the snapshot name and volume name
+        :param timeout: the timeout in seconds of a single attempt, the request is retried if not specified
+        :return: true if the snapshot was created
+        """
+        created = True
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        secondary_backend_id = secondary_backend['backend_id']
+        try:
+            result = self._do_client_request(api_method='/create_snapshot', endpoint=endpoint,
+                                             data=snapshot_info, timeout=timeout, retry=timeout is None)
+            if not isinstance(result, dict):
+                raise ReplicatedVolumeBackendAPIException(data=result)
+            LOG.info(f"The snapshot {snapshot['name']} of {snapshot['volume_name']} has been created successfully'")
+        except ReplicatedVolumeBackendAPIException as a:
+            LOG.error(f"The snapshot {snapshot['name']} of {snapshot['volume_name']} "
+                      f"on backend {secondary_backend_id } was not created, "
+                      f"an ReplicatedVolumeBackendAPIException occurred: {a.message}")
+            created = False
+        except ReplicatedVolumeBackendRetryableException as a:
+            LOG.error(f"The snapshot {snapshot['name']}  of {snapshot['volume_name']} "
+                      f"on backend {secondary_backend_id } was not created, "
+                      f"an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
+            created = False
+        return created
+
+
+    def __is_snapshot_consistent(self, resource, resource_status, fenced) -> bool:
+        """
+        Checks that the snapshots taken on all backends contain the same data: all peers are connected and up to
+        date, and the volume is either not written or fenced with synchronous links
+        :param resource: resource object as dict
+        :param resource_status: the resource state reported by drbdsetup before the snapshot
+        :param fenced: true if the writes were suspended
+        :return: true if the snapshots are identical
+        """
+        if resource_status.get('role') == 'Primary' and not fenced:
+            return False
+        overrides = resource.get('protocol_overrides', {})
+        for secondary_backend in self.configuration.replication_device or []:
+            peer_backend_id = secondary_backend['backend_id']
+            connection = self.__get_peer_connection(resource, resource_status, peer_backend_id)
+            if connection is None or connection.get('connection-state') != 'Connected' or not all(
+                    d.get('peer-disk-state') == 'UpToDate' for d in connection.get('peer_devices', [])):
+                return False
+            link_mode = (overrides.get(self.__get_link_key(self.configuration.backend_id, peer_backend_id)) or
+                         self.__get_link_mode(resource, peer_backend_id))
+            if fenced and REPLICATION_PROTOCOLS.get(link_mode) != 'C':
+                return False
+        return True
+
+
+    def __suspend_io(self, resource_id) -> bool:
+        """
+        Suspends the writes to the drbd resource
+        :param resource_id: drbd resource id
+        :return: true if the writes were suspended
+        """
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('drbdadm', 'suspend-io', resource_id, root_helper=root_helper, run_as_root=True)
+            return True
+        except processutils.ProcessExecutionError as e:
+            LOG.warning(f"Failed to suspend the writes to the resource {resource_id}, error message was: {e.stderr}")
+        return False
+
+
+    def __resume_io(self, resource_id):
+        """
+        Resumes the writes to the drbd resource
+        :param resource_id: drbd resource id
+        :return: None
+        """
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('drbdadm', 'resume-io', resource_id, root_helper=root_helper, run_as_root=True)
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to resume the writes to the resource {resource_id}, error message was: {e.stderr}")
+
+
+    @timed
+    def revert_to_snapshot(self, context, volume, snapshot):
+        """
+        Reverts the volume to the snapshot on all backends. The snapshot is merged on the secondary backends and
+        locally at the same time, then the drbd metadata is recreated. Identical snapshots are reverted without
+        resynchronization, otherwise the current backend becomes the source of a full resync
+        :param context: openstack context
+        :param volume: the volume object
+        :param snapshot: the snapshot object
+        :return: None
+        """
+        if self.configuration.lvm_type == 'thin':
+            msg = _("Revert volume to snapshot not implemented for thin LVM.")
+            raise NotImplementedError(msg)
+
+        resource = self.__load_resource_meta(volume['id'])
+        if resource is None:
+            return super().revert_to_snapshot(context, volume, snapshot)
+
+        consistent = snapshot['name'] in resource.get('consistent_snapshots', [])
+        revert_info = {
+            'volume_id': volume['id'],
+            'volume_name': volume['name'],
+            'snapshot_name': snapshot['name'],
+        }
+        started = time.monotonic()
+
+        def revert(secondary_backend):
             endpoint = self.__get_remote_backend_endpoint(secondary_backend)
-            secondary_backend_id = secondary_backend['backend_id']
             try:
-                self._do_client_request(api_method='/create_snapshot', endpoint=endpoint, data=snapshot_info)
-                LOG.info(f"The snapshot {snapshot['name']} of {snapshot['volume_name']} has been created successfully'")
-            except ReplicatedVolumeBackendAPIException as a:
-                LOG.error(f"The snapshot {snapshot['name']} of {snapshot['volume_name']} "
-                          f"on backend {secondary_backend_id } was not created, "
-                          f"an ReplicatedVolumeBackendAPIException occurred: {a.message}")
-            except ReplicatedVolumeBackendRetryableException as a:
-                LOG.error(f"The snapshot {snapshot['name']}  of {snapshot['volume_name']} "
-                          f"on backend {secondary_backend_id } was not created, "
-                          f"an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
+                self._do_client_job(api_method='/revert_to_snapshot', endpoint=endpoint,
+                                    data={'resources': [revert_info]})
+                return True
+            except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                LOG.error(f"The volume replica {volume['id']} on backend {secondary_backend['backend_id']} was "
+                          f"not reverted to the snapshot {snapshot['name']}, an exception occurred: {a.message}")
+            return False
+
+        secondary_backends = self.configuration.replication_device or []
+        with futures.ThreadPoolExecutor(max_workers=max(len(secondary_backends), 1)) as executor:
+            remote = executor.map(revert, secondary_backends)
+            self.__revert_replica(revert_info)
+            reverted = all(list(remote))
+
+        if consistent and reverted:
+            self.__skipping_initial_resynchronization(resource)
+            LOG.info(f"The volume {volume['id']} was reverted to the snapshot {snapshot['name']} on all backends "
+                     f"without resynchronization in {time.monotonic() - started:.1f}s")
+        else:
+            self.__set_drbd_resource_primary(resource_id=volume['id'], force=True)
+            LOG.warning(f"The volume {volume['id']} was reverted to the snapshot {snapshot['name']} in "
+                        f"{time.monotonic() - started:.1f}s, the secondary backends are fully resynchronized")
+
+        # Recreate the snapshot that was destroyed by the revert
+        self.create_snapshot(snapshot)
+
+
+    def __revert_replica(self, revert_info):
+        """
+        Stops the drbd resource, merges the snapshot into the logical volume and recreates the drbd metadata
+        :param revert_info: the volume id, volume name and snapshot name
+        :return: None
+        """
+        resource_id = revert_info['volume_id']
+        root_helper = utils.get_root_helper()
+        self._execute('drbdadm', 'down', resource_id, root_helper=root_helper, run_as_root=True)
+        self.vg.revert(self._escape_snapshot(revert_info['snapshot_name']))
+        self.vg.deactivate_lv(revert_info['volume_name'])
+        self.vg.activate_lv(revert_info['volume_name'])
+        # the internal metadata was merged back with the data
+        self._execute('drbdadm', 'create-md', '--force', resource_id, root_helper=root_helper, run_as_root=True)
+        self._execute('drbdadm', 'up', resource_id, root_helper=root_helper, run_as_root=True)
+        resource = self.__load_resource_meta(resource_id)
+        if resource is not None and revert_info['snapshot_name'] in resource.get('consistent_snapshots', []):
+            resource['consistent_snapshots'].remove(revert_info['snapshot_name'])
+            self.__save_resource_meta(resource)
+        LOG.info(f"The volume replica {resource_id} was reverted to the snapshot {revert_info['snapshot_name']}")
+
+
+    def __revert_replicas(self, request):
+        """
+        Reverts the volume replicas requested by the primary backend
+        :param request: the list of volume ids, volume names and snapshot names
+        :return: empty result
+        """
+        for revert_info in request['resources']:
+            self.__revert_replica(revert_info)
+        return {}
 
+    @timed
     def delete_snapshot(self, snapshot):
         super().delete_snapshot(snapshot)
+        if snapshot.get('volume_id') is None:
+            # the temporary snapshot of a thick clone was not replicated
+            return
+        resource = self.__load_resource_meta(snapshot['volume_id'])
+        if resource is not None and snapshot['name'] in resource.get('consistent_snapshots', []):
+            resource['consistent_snapshots'].remove(snapshot['name'])
+            self.__save_resource_meta(resource)
         snapshot_info = {
             'name': snapshot['name'],
         }
@@ -207,12 +867,199 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                           f"an ReplicatedVolumeBackendRetryableException  occurred: {a.message}")
 
 
+    def backup_use_temp_snapshot(self):
+        return self.configuration.replication_backup_from_secondary or super().backup_use_temp_snapshot()
+
+
+    def get_backup_device(self, context, backup):
+        # cinder creates the temporary snapshot of the backup within this call, the backup is remembered for
+        # the current thread so create_snapshot can tell it from the other snapshots of the volume
+        self._backup_device.backup = backup
+        try:
+            return super().get_backup_device(context, backup)
+        finally:
+            self._backup_device.backup = None
+
+
+    def __is_backup_snapshot(self, snapshot) -> bool:
+        """
+        Checks that the snapshot is the temporary snapshot of a backup that must be taken from a secondary
+        :param snapshot: the snapshot object
+        :return: true if the snapshot is created on a secondary backend
+        """
+        backup = getattr(self._backup_device, 'backup', None)
+        return (self.configuration.replication_backup_from_secondary and backup is not None and
+                not backup.snapshot_id and backup.volume_id == snapshot.get('volume_id'))
+
+
+    def __get_snapshot_backend(self, snapshot):
+        """
+        Returns the secondary backend that holds the snapshot
+        :param snapshot: the snapshot object
+        :return: the replication_device entry or None if the snapshot is local
+        """
+        provider_id = snapshot.get('provider_id')
+        for secondary_backend in self.configuration.replication_device or []:
+            if secondary_backend['backend_id'] == provider_id:
+                return secondary_backend
+        return None
+
+
+    def __create_secondary_snapshot(self, snapshot):
+        """
+        Creates the snapshot on the first secondary backend that is connected and up to date
+        :param snapshot: the snapshot object
+        :return: model update or None if no secondary backend can take the snapshot
+        """
+        volume_id = snapshot['volume_id']
+        resource = self.__load_resource_meta(volume_id)
+        resource_status = next(iter(self.__get_drbd_status(volume_id)), None)
+        if resource is None or resource_status is None:
+            return None
+
+        snapshot_info = {
+            'name': snapshot['name'],
+            'volume_name': snapshot['volume_name'],
+        }
+        for secondary_backend in self.configuration.replication_device or []:
+            secondary_backend_id = secondary_backend['backend_id']
+            connection = self.__get_peer_connection(resource, resource_status, secondary_backend_id)
+            if connection is None or connection.get('connection-state') != 'Connected' or not all(
+                    d.get('peer-disk-state') == 'UpToDate' for d in connection.get('peer_devices', [])):
+                continue
+            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+            try:
+                self._do_client_request(api_method='/create_snapshot', endpoint=endpoint, data=snapshot_info)
+            except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                LOG.warning(f"The backup snapshot {snapshot['name']} was not created on backend "
+                            f"{secondary_backend_id}, an exception occurred: {a.message}")
+                continue
+            LOG.info(f"The backup snapshot {snapshot['name']} of {snapshot['volume_name']} was created on "
+                     f"backend {secondary_backend_id}")
+            return {'provider_id': secondary_backend_id}
+
+        LOG.warning(f"No secondary backend is in sync for the volume {volume_id}, "
+                    f"the backup snapshot {snapshot['name']} is taken on the primary")
+        return None
+
+
+    def __request_snapshot_backend(self, snapshot, api_method, data):
+        """
+        Sends the snapshot request to the secondary backend that holds the snapshot
+        :param snapshot: the snapshot object
+        :param api_method: the api method
+        :param data: the request payload
+        :return: the response
+        """
+        secondary_backend = self.__get_snapshot_backend(snapshot)
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        data = dict(data, snapshot_id=snapshot['id'])
+        result = self._do_client_request(api_method=api_method, endpoint=endpoint, data=data)
+        if not isinstance(result, dict):
+            raise ReplicatedVolumeBackendAPIException(data=result)
+        return result
+
+
+    def create_export_snapshot(self, context, snapshot, connector):
+        if self.__get_snapshot_backend(snapshot) is None:
+            return super().create_export_snapshot(context, snapshot, connector)
+        return self.__request_snapshot_backend(snapshot, '/create_snapshot_export', {})
+
+
+    def remove_export_snapshot(self, context, snapshot):
+        if self.__get_snapshot_backend(snapshot) is None:
+            return super().remove_export_snapshot(context, snapshot)
+        self.__request_snapshot_backend(snapshot, '/remove_snapshot_export', {})
+
+
+    def initialize_connection_snapshot(self, snapshot, connector, **kwargs):
+        if self.__get_snapshot_backend(snapshot) is None:
+            return super().initialize_connection_snapshot(snapshot, connector, **kwargs)
+        return self.__request_snapshot_backend(snapshot, '/initialize_snapshot_connection',
+                                               {'connector': connector})
+
+
+    def terminate_connection_snapshot(self, snapshot, connector, **kwargs):
+        if self.__get_snapshot_backend(snapshot) is None:
+            return super().terminate_connection_snapshot(snapshot, connector, **kwargs)
+        self.__request_snapshot_backend(snapshot, '/terminate_snapshot_connection', {'connector': connector})
+
+
+    @timed
+    def retype(self, context, volume, new_type, diff, host):
+        """
+        Retypes a volume. Changes of the replication settings are applied online: the drbd configuration is
+        rewritten on all secondary backends with one request per backend and on the current backend, then applied
+        with drbdadm adjust, no data is moved. Links with their own replication_mode in replication_device keep it
+        :param context: the openstack context
+        :param volume: the volume object
+        :param new_type: the new volume type
+        :param diff: the difference between the volume types
+        :param host: the target host
+        :return: true if the volume was retyped
+        """
+        if (volume_utils.extract_host(host['host'], 'backend') !=
+                volume_utils.extract_host(volume['host'], 'backend')):
+            return False
+
+        extra_specs = diff.get('extra_specs') or {}
+        if 'replication_enabled' in extra_specs or 'ovt_ev3:multipath_export' in extra_specs:
+            return False
+        changes = {k: v[1] for k, v in extra_specs.items() if k in REPLICATION_SPECS}
+        if not changes:
+            return super().retype(context, volume, new_type, diff, host)
+
+        resource = self.__load_resource_meta(volume['id'])
+        if resource is None:
+            LOG.warning(f"The replicated resource of volume {volume['id']} was not found, it can't be retyped online")
+            return False
+
+        if 'ovt_ev3:replication_mode' in changes:
+            replication_mode = changes['ovt_ev3:replication_mode'] or self.configuration.replication_mode
+            if replication_mode not in REPLICATION_PROTOCOLS:
+                LOG.error(f"Unknown replication mode {replication_mode} of volume type {new_type['name']}")
+                return False
+            if resource.get('dual_primary') and replication_mode != 'full-sync':
+                # drbd allows two primaries on synchronous links only
+                LOG.error(f"The volume {volume['id']} is exported by all backends and requires full-sync "
+                          f"replication, it can't be retyped to {replication_mode}")
+                return False
+            resource['replication_mode'] = replication_mode
+            if replication_mode != 'full-sync':
+                resource.pop('protocol_overrides', None)
+            # links between secondary backends derive their mode from the resource, so the whole mesh is updated
+            replication_devices = {b['backend_id']: b for b in self.configuration.replication_device or []}
+            for connection in resource.get('connections', []):
+                if self.configuration.backend_id not in connection['hosts']:
+                    connection['replication_mode'] = self.__get_secondary_link_mode(
+                        [replication_devices.get(h, {}) for h in connection['hosts']], replication_mode)
+        if 'ovt_ev3:verify_alg' in changes:
+            resource.setdefault('net', {})['verify-alg'] = (changes['ovt_ev3:verify_alg'] or
+                                                            self.configuration.replication_verify_alg)
+
+        started = time.monotonic()
+        if not self.__adjust_replication([resource]):
+            return False
+        LOG.info(f"Replication settings of volume {volume['id']} were changed online in "
+                 f"{time.monotonic() - started:.1f}s: {changes}")
+        return super().retype(context, volume, new_type, diff, host)
+
+
     def _update_volume_stats(self):
         """
-        Updates the volume stats
+        Updates the volume stats. The volume group is rescanned only when the cached capacity is older than
+        replication_stats_cache_ttl, otherwise the incrementally adjusted capacity is reported
         :return: the volume stats
         """
-        super()._update_volume_stats()
+        started = time.monotonic()
+        with self._stats_lock:
+            ttl = self.configuration.replication_stats_cache_ttl
+            rescan = (ttl <= 0 or self._stats_refreshed_at is None or not self._stats.get('pools') or
+                      started - self._stats_refreshed_at >= ttl)
+            if rescan:
+                super()._update_volume_stats()
+                self._stats_refreshed_at = time.monotonic()
+
         replication_enabled = self.configuration.replication_device is not None
         replication_status = fields.ReplicationStatus.ENABLED
         replication_targets = []
@@ -243,6 +1090,103 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                 pool['replication_mode'] = ['async', 'semi-sync', 'full-sync']
                 pool['replication_targets'] = replication_targets
 
+        if self.configuration.replication_adaptive_protocol:
+            self._stats['replication_protocol_switches'] = len(self._protocol_switch_events)
+            self._stats['replication_degraded_links'] = sum(
+                len(r.get('protocol_overrides', {})) for r in self.__list_resources())
+
+        with self._portal_lock:
+            if self._portal_connections:
+                self._stats['multipath_portal_connections'] = dict(self._portal_connections)
+            else:
+                self._stats.pop('multipath_portal_connections', None)
+
+        if self.configuration.replication_warm_pool:
+            self._stats['replication_warm_pool'] = dict(collections.Counter(
+                r.get('pool_key') for r in self.__list_pooled_resources()))
+
+        if self.configuration.replication_fast_delete:
+            self._stats['replication_deleting_volumes'] = len(
+                os.listdir(f"{CONF.get('state_path')}/{RESOURCE_DELETING}"))
+
+        if any('paths' in b for b in self.configuration.replication_device or []):
+            if rescan or 'replication_link_paths' not in self._stats:
+                # drbd status is read on the rescan interval only, like the capacity
+                self._stats['replication_link_paths'] = self.__get_link_paths()
+
+        if self._verify_findings is not None:
+            self._stats['replication_verify_out_of_sync_volumes'] = sum(
+                1 for kb in self._verify_findings.values() if kb > 0)
+            self._stats['replication_verify_out_of_sync_gb'] = round(
+                sum(self._verify_findings.values()) / units.Mi, 2)
+
+        if self.__is_discard_resync():
+            self._stats['replication_resync_total_gb'] = round(self._resync_total_kb / units.Mi, 2)
+            self._stats['replication_resync_skipped_gb'] = round(self._resync_skipped_kb / units.Mi, 2)
+
+        elapsed = time.monotonic() - started
+        self._stats['stats_collection_seconds'] = round(elapsed, 3)
+        LOG.debug(f"Volume stats were collected in {elapsed:.3f}s "
+                  f"({'volume group rescan' if rescan else 'cached capacity'})")
+
+
+    def get_volume_stats(self, refresh=False):
+        """
+        Returns the volume stats with the capacity that is available on all backends: the free and total capacity
+        of the pools are the minimum and the provisioned capacity is the maximum of this and the secondary
+        backends, so the scheduler doesn't place volumes that can't be replicated. An unreachable secondary
+        backend doesn't limit the capacity unless replication_peer_unreachable_no_capacity is set
+        :param refresh: true to update the stats
+        :return: the volume stats
+        """
+        stats = super().get_volume_stats(refresh)
+        if not self.configuration.replication_device:
+            return stats
+
+        # the cached local capacity is adjusted incrementally, so the effective capacity is reported on a copy
+        stats = copy.deepcopy(stats)
+        peer_status = self.__get_peer_status()
+        stats['replication_peers'] = {
+            backend_id: dict((heartbeat or {}).get('health', {}), reachable=heartbeat is not None)
+            for backend_id, heartbeat in peer_status.items()
+        }
+        for pool in stats.get('pools', []):
+            peer_free = {}
+            for backend_id, heartbeat in peer_status.items():
+                if heartbeat is None:
+                    if self.configuration.replication_peer_unreachable_no_capacity:
+                        # volumes can't be replicated to the backend, so none are placed here until it's back
+                        pool['free_capacity_gb'] = 0
+                        peer_free[backend_id] = 0
+                    continue
+                capacity = heartbeat.get('capacity') or {}
+                for key, choose in (('free_capacity_gb', min), ('total_capacity_gb', min),
+                                    ('provisioned_capacity_gb', max)):
+                    value = capacity.get(key)
+                    if isinstance(value, (int, float)) and isinstance(pool.get(key), (int, float)):
+                        pool[key] = choose(pool[key], value)
+                if 'free_capacity_gb' in capacity:
+                    peer_free[backend_id] = capacity['free_capacity_gb']
+            pool['replication_peer_free_capacity_gb'] = peer_free
+        return stats
+
+
+    def __account_capacity(self, size_gb, volumes=0):
+        """
+        Incrementally adjusts the cached pool capacity after logical volumes were created, extended or deleted
+        :param size_gb: allocated size in GiB, negative when released
+        :param volumes: the change of the number of volumes
+        :return: None
+        """
+        with self._stats_lock:
+            for pool in self._stats.get('pools', []):
+                pool['provisioned_capacity_gb'] = round(float(pool.get('provisioned_capacity_gb', 0)) + size_gb, 2)
+                if self.configuration.lvm_type != 'thin':
+                    # the free capacity reported by the volume group is already divided by the mirror count
+                    pool['free_capacity_gb'] = round(float(pool.get('free_capacity_gb', 0)) - size_gb, 2)
+                if 'total_volumes' in pool:
+                    pool['total_volumes'] += volumes
+
 
     @staticmethod
     def _is_replicated(volume):
@@ -255,10 +1199,14 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         return specs.get('replication_enabled') == '<is> True'
 
 
+    @timed
     def failover_host(self, context, volumes, secondary_id=None, groups=None):
         """
         Failover to replication target.
         This function combines calls to failover() and failover_completed() to perform failover when Active/Active is not enabled.
+        Resources are promoted and demoted in parallel batches with one request per secondary backend, every phase
+        is timed. Volumes that were not promoted get the replication status error. On failback the volumes that
+        are not passed by the volume manager are updated in the database in bulk
         :param context: the openstack context
         :param volumes: the volume object
         :param secondary_id: the secondary backend id
@@ -270,6 +1218,8 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         if secondary_id is None:
             return secondary_id, model_updates, []
 
+        started = time.monotonic()
+        phases = []
         active_backend_id = secondary_id
 
         if secondary_id == 'default':
@@ -281,30 +1231,138 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                 'host': host,
                 'provider_id': active_backend_id,
                 'replication_status': fields.ReplicationStatus.FAILED_OVER,
-                'updated_at': datetime.datetime.now(),
             }
+            volume_ids = sorted(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_META}/"))
 
-            for f in os.listdir(f"{CONF.get('state_path')}/{RESOURCE_META}/"):
-                model_updates.append({
-                    'volume_id': f,
-                    'updates': volume_update,
-                })
-                self.db.volume_update(context,f,volume_update)
+            # best effort, a dead secondary backend gets one attempt and doesn't block the failover
+            for secondary_backend in self.configuration.replication_device or []:
+                self.__request_role_change(secondary_backend, '/demote_volumes', volume_ids, timeout=10)
+            phases.append(('demote secondary backends', time.monotonic()))
+
+            failed = self.__promote_resources(volume_ids)
+            phases.append(('promote', time.monotonic()))
         else:
-            for volume in volumes:
-                host =  secondary_id + '#' + self.configuration.volume_backend_name
+            host = secondary_id + '#' + self.configuration.volume_backend_name
+            volume_update = {
+                'host': host,
+                'provider_id': active_backend_id,
+                'replication_status': fields.ReplicationStatus.ENABLED,
+            }
+            volume_ids = [volume['id'] for volume in volumes]
+
+            self.__demote_resources(volume_ids)
+            phases.append(('demote', time.monotonic()))
+
+            failed = []
+            secondary_backend = next((b for b in self.configuration.replication_device or []
+                                      if b['backend_id'] == secondary_id), None)
+            if secondary_backend is None:
+                LOG.warning(f"The backend {secondary_id} is not a replication device, "
+                            f"its volumes are promoted on first export")
+            else:
+                failed = self.__request_role_change(secondary_backend, '/promote_volumes', volume_ids)
+            phases.append((f"promote on {secondary_id}", time.monotonic()))
+
+        failed_ids = set(failed)
+        listed_ids = {volume['id'] for volume in volumes}
+        unlisted = []
+        for volume_id in volume_ids:
+            updates = (volume_update if volume_id not in failed_ids
+                       else {'replication_status': fields.ReplicationStatus.ERROR})
+            if volume_id in listed_ids:
                 model_updates.append({
-                    'volume_id': volume['id'],
-                    'updates': {
-                        'host': host,
-                        'provider_id': active_backend_id,
-                        'replication_status': fields.ReplicationStatus.ENABLED,
-                    }
+                    'volume_id': volume_id,
+                    'updates': updates,
                 })
+            else:
+                unlisted.append(dict(updates, id=volume_id))
+
+        # volumes moved to the secondary backend by the failover are not passed on failback, they are
+        # written in bulk
+        for batch in self.__batches(unlisted, self.configuration.replication_bulk_batch_size):
+            self.db.volumes_update(context, batch)
+        phases.append(('database update', time.monotonic()))
+
+        timings = []
+        previous = started
+        for phase, finished in phases:
+            timings.append(f"{phase} {finished - previous:.1f}s")
+            previous = finished
+        LOG.info(f"Failover of {len(volume_ids)} volumes to {active_backend_id} took {previous - started:.1f}s "
+                 f"({', '.join(timings)}), {len(failed)} resources were not promoted: {failed}")
 
         return active_backend_id, model_updates, []
 
 
+    def __request_role_change(self, secondary_backend, api_method, volume_ids, timeout=None) -> list:
+        """
+        Requests the secondary backend to promote or demote resources with one request
+        :param secondary_backend: the replication_device entry
+        :param api_method: /promote_volumes or /demote_volumes
+        :param volume_ids: the volume ids
+        :param timeout: the timeout in seconds of a single attempt, the request is sent as a job if not specified
+        :return: list of volume ids that failed to change the role
+        """
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        try:
+            if timeout is None:
+                result = self._do_client_job(api_method=api_method, endpoint=endpoint,
+                                             data={'volume_ids': volume_ids})
+            else:
+                result = self._do_client_request(api_method=api_method, endpoint=endpoint,
+                                                 data={'volume_ids': volume_ids}, timeout=timeout, retry=False)
+        except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+            LOG.error(f"The request {api_method} of {len(volume_ids)} volumes on backend "
+                      f"{secondary_backend['backend_id']} failed, an exception occurred: {a.message}")
+            return volume_ids
+        return result.get('failed', []) if isinstance(result, dict) else volume_ids
+
+
+    def __promote_resources(self, resource_ids) -> list:
+        """
+        Promotes local drbd resources in parallel batches
+        :param resource_ids: drbd resource ids
+        :return: list of resource ids that were not promoted
+        """
+        failed = []
+        with futures.ThreadPoolExecutor(max_workers=self.configuration.replication_bulk_workers) as executor:
+            for f in executor.map(self.__set_drbd_resources_primary,
+                                  self.__batches(resource_ids, self.configuration.replication_bulk_batch_size)):
+                failed += f
+        return failed
+
+
+    def __demote_resources(self, resource_ids) -> list:
+        """
+        Demotes local drbd resources in parallel batches, resources are demoted one by one if a batch fails
+        :param resource_ids: drbd resource ids
+        :return: list of resource ids that were not demoted
+        """
+        root_helper = utils.get_root_helper()
+
+        def demote(batch):
+            try:
+                self._execute('drbdadm', 'secondary', *batch, root_helper=root_helper, run_as_root=True)
+                return []
+            except processutils.ProcessExecutionError:
+                pass
+            failed = []
+            for resource_id in batch:
+                try:
+                    self._execute('drbdadm', 'secondary', resource_id, root_helper=root_helper, run_as_root=True)
+                except processutils.ProcessExecutionError as e:
+                    LOG.warning(f"Failed to set the replication role secondary for the resource {resource_id}, "
+                                f"error message was: {e.stderr}")
+                    failed.append(resource_id)
+            return failed
+
+        failed = []
+        with futures.ThreadPoolExecutor(max_workers=self.configuration.replication_bulk_workers) as executor:
+            for f in executor.map(demote, self.__batches(resource_ids, self.configuration.replication_bulk_batch_size)):
+                failed += f
+        return failed
+
+
     @staticmethod
     def __get_remote_backend_endpoint(secondary_backend):
         """
@@ -323,25 +1381,48 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         :param volume: the volume object
         :return: None
         """
-        repl_status = fields.ReplicationStatus.DISABLED
         resource = self.__get_resource(volume)
+        try:
+            return self.__setup_local_replication(resource, self.__create_remote_replicas(resource))
+        finally:
+            self._reserved_minors.discard(resource['device_minor'])
 
-        for secondary_backend in self.configuration.replication_device:
+
+    def __create_remote_replicas(self, resource):
+        """
+        Creates the replicas on all secondary backends in parallel
+        :param resource: resource object as dict
+        :return: the replication status
+        """
+        def create(secondary_backend):
             endpoint = self.__get_remote_backend_endpoint(secondary_backend)
             try:
-                self._do_client_request(api_method='/create_volume', endpoint=endpoint, data=resource)
-                LOG.info(f"Remote drbd resource for {volume['name']} has been created successfully'")
-                if repl_status in fields.ReplicationStatus.DISABLED:
-                    repl_status = fields.ReplicationStatus.ENABLED
+                self._do_client_job(api_method='/create_volume', endpoint=endpoint, data=resource)
+                LOG.info(f"Remote drbd resource for {resource['volume_name']} has been created successfully'")
+                return True
             except ReplicatedVolumeBackendAPIException as a:
-                LOG.error(f"The resource for {volume['name']} on backend {secondary_backend} was not created, "
-                          f"an ReplicatedVolumeBackendAPIException occurred: {a.message}")
-                repl_status = fields.ReplicationStatus.ERROR
+                LOG.error(f"The resource for {resource['volume_name']} on backend {secondary_backend} was not "
+                          f"created, an ReplicatedVolumeBackendAPIException occurred: {a.message}")
             except ReplicatedVolumeBackendRetryableException as a:
-                LOG.error(f"The resource for {volume['name']} on backend {secondary_backend} was not created, "
-                          f"an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
-                repl_status = fields.ReplicationStatus.ERROR
+                LOG.error(f"The resource for {resource['volume_name']} on backend {secondary_backend} was not "
+                          f"created, an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
+            return False
+
+        secondary_backends = self.configuration.replication_device or []
+        if not secondary_backends:
+            return fields.ReplicationStatus.DISABLED
+        with futures.ThreadPoolExecutor(max_workers=len(secondary_backends)) as executor:
+            created = list(executor.map(create, secondary_backends))
+        return fields.ReplicationStatus.ENABLED if all(created) else fields.ReplicationStatus.ERROR
+
 
+    def __setup_local_replication(self, resource, repl_status):
+        """
+        Starts the local drbd resource once the local volume and the remote replicas exist
+        :param resource: resource object as dict
+        :param repl_status: the replication status of remote replicas
+        :return: model update
+        """
         self.__save_resource_meta(resource)
         self.__setup_drbd_config(resource)
         self.__skipping_initial_resynchronization(resource)
@@ -359,26 +1440,34 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         Extends the replicated volume
         :param volume: the volume object
         :param new_size: the new size of replicated object
-        :return: None
+        :return: true if all replicas were extended
         """
-        resource = self.__get_resource(volume)
-        resource['volume_size'] = new_size
-        for secondary_backend in self.configuration.replication_device:
-            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        resource = {
+            'volume_id': volume['id'],
+            'volume_name': volume['name'],
+            'volume_size': new_size,
+        }
 
+        def extend(secondary_backend):
+            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
             try:
-                self._do_client_request(api_method='/extend_volume', endpoint=endpoint, data=resource)
+                self._do_client_job(api_method='/extend_volume', endpoint=endpoint, data=resource)
                 LOG.info(f"The size of replicated volume {volume['name']} on backend {secondary_backend['backend_id']} "
                          f"was successfully resized to {self._sizestr(new_size)}")
+                return True
             except ReplicatedVolumeBackendAPIException as a:
                 LOG.error(f"The replicated volume {volume['name']} on backend {secondary_backend['backend_id']} was not resized, "
                           f"an ReplicatedVolumeBackendAPIException occurred: {a.message}")
-                return False
             except ReplicatedVolumeBackendRetryableException as a:
                 LOG.error(f"The replicated volume {volume['name']} on backend {secondary_backend['backend_id']} was not resized. "
                           f"an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
-                return False
-        return True
+            return False
+
+        secondary_backends = self.configuration.replication_device or []
+        if not secondary_backends:
+            return True
+        with futures.ThreadPoolExecutor(max_workers=len(secondary_backends)) as executor:
+            return all(list(executor.map(extend, secondary_backends)))
 
 
     def delete_replication(self, volume):
@@ -389,14 +1478,16 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         """
         resource = {
             'volume_id': volume['id'],
-            'volume_name': volume['name']
+            'volume_name': volume['name'],
+            'volume_size': volume['size'],
         }
+        self.__remove_drbd_config(resource)
 
-        for b in self.configuration.replication_device:
+        def delete(b):
             secondary_backend_id = b['backend_id']
             endpoint = self.__get_remote_backend_endpoint(secondary_backend=b)
             try:
-                self._do_client_request(api_method='/delete_volume', endpoint=endpoint, data=resource)
+                self._do_client_job(api_method='/delete_volume', endpoint=endpoint, data=resource)
                 LOG.info(f"Remote drbd resource for {volume['name']} has been remove successfully'")
             except ReplicatedVolumeBackendAPIException as a:
                 LOG.error(f"The resource for {volume['name']} on backend {secondary_backend_id} was not deleted, "
@@ -404,8 +1495,13 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             except ReplicatedVolumeBackendRetryableException as a:
                 LOG.error(f"The resource for {volume['name']} on backend {secondary_backend_id} was not deleted, "
                           f"an ReplicatedVolumeBackendRetryableException occurred: {a.message}")
+
+        # the replicas are wiped by the secondary backends at the same time
+        secondary_backends = self.configuration.replication_device or []
+        if secondary_backends:
+            with futures.ThreadPoolExecutor(max_workers=len(secondary_backends)) as executor:
+                list(executor.map(delete, secondary_backends))
         self.__delete_resource_meta(resource)
-        self.__remove_drbd_config(resource)
 
 
     def __save_resource_meta(self, resource):
@@ -419,6 +1515,50 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             json.dump(resource, file, indent=4)
 
 
+    def __load_resource_meta(self, resource_id):
+        """
+        Loads the configuration resource stored on the file system
+        :param resource_id: resource id
+        :return: resource object as dict or None if the resource is not found
+        """
+        resource_path = self.__get_resource_path(resource_id)
+        if not os.path.exists(resource_path):
+            return None
+        with open(resource_path, "r") as file:
+            return json.load(file)
+
+
+    def __update_resource_meta_size(self, resource_id, new_size):
+        """
+        Updates the volume size of the configuration resource stored on the file system
+        :param resource_id: resource id
+        :param new_size: the new size
+        :return: the previous size or None if the resource is not found
+        """
+        resource = self.__load_resource_meta(resource_id)
+        if resource is None:
+            return None
+        size = resource.get('volume_size')
+        resource['volume_size'] = new_size
+        self.__save_resource_meta(resource)
+        return size
+
+
+    def __list_resources(self):
+        """
+        Iterates over the configuration resources stored on the file system
+        :return: generator of resource objects as dict
+        """
+        for resource_id in sorted(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_META}/")):
+            try:
+                resource = self.__load_resource_meta(resource_id)
+            except (IOError, ValueError) as e:
+                LOG.warning(f"Failed to load the configuration resource {resource_id}: {e}")
+                continue
+            if resource is not None:
+                yield resource
+
+
     def __delete_resource_meta(self, resource):
         """
         Deletes the configuration resource stored on the file system
@@ -430,6 +1570,16 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             os.remove(resource_path)
 
 
+    @staticmethod
+    def __get_deleting_resource_path(resource_id):
+        """
+        Returns the path to the resource of the deleted volume waiting for the reaper
+        :param resource_id: resource id
+        :return: the path to the resource
+        """
+        return f"{CONF.get('state_path')}/{RESOURCE_DELETING}/{resource_id}"
+
+
     @staticmethod
     def __get_resource_path(resource_id):
         """
@@ -452,14 +1602,18 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         backends.append({
             'id': self.configuration.backend_id,
             'ip': self.configuration.backend_ip,
-            'volume': f"/dev/{self.configuration.volume_group}/{volume.name}"
+            'volume': f"/dev/{self.configuration.volume_group}/{volume.name}",
+            'hostname': self.hostname,
+            'node_id': 0,
         })
 
-        for b in self.configuration.replication_device:
+        for node_id, b in enumerate(self.configuration.replication_device, start=1):
             backends.append({
                 'id': b['backend_id'],
                 'ip': b['ip'],
                 'volume': f"/dev/{b['volume_group']}/{volume.name}",
+                'hostname': b.get('hostname', b['backend_id'].split('@')[0]),
+                'node_id': node_id,
             })
 
         resource = {
@@ -467,14 +1621,207 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             'volume_name': volume.name,
             'volume_size': volume.size,
             'device_minor': minor,
-            'replication_mode': self.configuration.replication_mode,
+            'replication_mode': self.__get_volume_type_spec(volume, 'ovt_ev3:replication_mode',
+                                                            self.configuration.replication_mode),
             'replication_port': self.configuration.replication_starting_port + minor,
             'backends': backends,
+            'net': {
+                'verify-alg': self.__get_volume_type_spec(volume, 'ovt_ev3:verify_alg',
+                                                          self.configuration.replication_verify_alg),
+            },
         }
+        if self.__is_mesh_topology():
+            try:
+                resource['connections'] = self.__get_connections(backends, minor, resource['replication_mode'])
+            except exception.VolumeBackendAPIException:
+                self._reserved_minors.discard(minor)
+                raise
+        for peer_backend_id, link_buffers in self._link_buffers.items():
+            if link_buffers['buffers'] is not None:
+                self.__apply_link_buffers(resource, peer_backend_id, link_buffers['buffers'])
+        if self.__get_volume_type_spec(volume, 'ovt_ev3:multipath_export', '').lower() in ('<is> true', 'true'):
+            if resource['replication_mode'] == 'full-sync' and not self.__get_async_link_modes():
+                resource['dual_primary'] = True
+                resource['net'].update({
+                    'allow-two-primaries': 'yes',
+                    'after-sb-0pri': 'discard-zero-changes',
+                    'after-sb-1pri': 'discard-secondary',
+                    'after-sb-2pri': 'disconnect',
+                })
+                # writes are fenced by drbd as soon as the link is lost, so both primaries never diverge
+                if len(backends) > 2:
+                    resource['options'] = {'quorum': 'majority', 'on-no-quorum': 'io-error'}
+                elif self.configuration.replication_multipath_fence_peer:
+                    resource['net']['fencing'] = 'resource-and-stonith'
+                    resource['handlers'] = {
+                        'fence-peer': f'"{self.configuration.replication_multipath_fence_peer}"',
+                    }
+                else:
+                    resource['options'] = {'quorum': 'majority', 'on-no-quorum': 'suspend-io'}
+            else:
+                LOG.warning(f"Multipath export of volume {volume.id} requires full-sync replication on all links, "
+                            f"the volume is exported from the primary backend only")
+        if self.__is_discard_resync():
+            resource['disk'] = {
+                'rs-discard-granularity': self.configuration.replication_rs_discard_granularity,
+                'discard-zeroes-if-aligned': 'yes',
+            }
         LOG.info(json.dumps(resource, indent=4))
 
         return resource
 
+
+    @staticmethod
+    def __get_volume_type_spec(volume, key, default):
+        """
+        Returns the extra spec of the volume type
+        :param volume: cinder volume
+        :param key: the extra spec key
+        :param default: the default value
+        :return: the extra spec value or default
+        """
+        volume_type = getattr(volume, 'volume_type', None)
+        specs = getattr(volume_type, 'extra_specs', None) or {}
+        return specs.get(key, default)
+
+
+    def __is_discard_resync(self):
+        """
+        Checks whether resync uses discard-based zero detection, which is the case for thin logical volumes
+        :return: true if zeroed blocks are discarded on the resync target
+        """
+        return self.configuration.lvm_type == 'thin' and self.configuration.replication_rs_discard_granularity > 0
+
+
+    def __get_async_link_modes(self) -> list:
+        """
+        Returns the replication modes of replication_device links that are not full-sync
+        :return: list of replication modes
+        """
+        return [b['replication_mode'] for b in self.configuration.replication_device or []
+                if b.get('replication_mode', 'full-sync') != 'full-sync']
+
+
+    def __is_mesh_topology(self):
+        """
+        Checks whether resources have to be rendered as a DRBD 9 connection mesh. That is required for more than one
+        secondary backend or when a replication_device entry carries its own link settings
+        :return: true if the connection mesh is required
+        """
+        replication_devices = self.configuration.replication_device or []
+        if len(replication_devices) > 1:
+            return True
+        for replication_device in replication_devices:
+            for key in replication_device.keys():
+                if key in LINK_SETTINGS or key.startswith(LINK_NET_OPTION_PREFIX):
+                    return True
+        return False
+
+
+    @staticmethod
+    def __get_link_net_options(replication_device) -> dict:
+        """
+        Extracts DRBD net options of the link from the replication_device entry,
+        e.g. net_max-buffers:8000 or net_sndbuf_size:4M
+        :param replication_device: the replication_device entry
+        :return: net options as dict
+        """
+        net_options = {}
+        for key, value in replication_device.items():
+            if key.startswith(LINK_NET_OPTION_PREFIX):
+                net_options[key[len(LINK_NET_OPTION_PREFIX):].replace('_', '-')] = value
+        return net_options
+
+
+    def __get_connections(self, backends, minor, replication_mode) -> list:
+        """
+        Makes the full connection mesh between the backends of the resource. Links of the current backend take
+        the protocol, port, network paths and net options from the replication_device entry of the peer, links between secondary
+        backends use the least synchronous mode of both ends
+        :param backends: the backends of the resource, the current backend is the first one
+        :param minor: drbd device minor
+        :param replication_mode: the replication mode of the resource
+        :return: list of connections
+        """
+        replication_devices = [{}] + list(self.configuration.replication_device)
+        # the first path of a link uses the port of the connection, further paths get their own port ranges
+        # after the ranges of all connections
+        links = len(backends) * (len(backends) - 1) // 2
+        path_ranges = max([len(self.__parse_paths(d.get('paths', ''))) for d in replication_devices] + [1]) - 1
+        if (links > 1 or path_ranges) and minor >= self.configuration.replication_link_port_offset:
+            # the port of the minor would fall into the port range of the next connection or path
+            raise exception.VolumeBackendAPIException(
+                data=_(f"The device minor {minor} doesn't fit into replication_link_port_offset "
+                       f"{self.configuration.replication_link_port_offset}, the ports of the connections collide"))
+        connections = []
+        link = 0
+        for a in range(len(backends)):
+            for b in range(a + 1, len(backends)):
+                port = self.configuration.replication_starting_port + link * self.configuration.replication_link_port_offset
+                net_options = {}
+                paths = []
+                if a == 0:
+                    replication_device = replication_devices[b]
+                    if 'replication_port' in replication_device:
+                        port = int(replication_device['replication_port'])
+                    net_options = self.__get_link_net_options(replication_device)
+                    paths = self.__parse_paths(replication_device.get('paths', ''))
+                    link_mode = replication_device.get('replication_mode')
+                else:
+                    link_mode = self.__get_secondary_link_mode(
+                        [replication_devices[a], replication_devices[b]], replication_mode)
+                connection = {
+                    'hosts': [backends[a]['id'], backends[b]['id']],
+                    'port': port + minor,
+                    'replication_mode': link_mode,
+                    'net': net_options,
+                }
+                if paths:
+                    connection['paths'] = [{
+                        'addresses': addresses,
+                        'port': port + minor if i == 0 else (
+                            self.configuration.replication_starting_port + minor +
+                            (links + link * path_ranges + i - 1) * self.configuration.replication_link_port_offset),
+                    } for i, addresses in enumerate(paths)]
+                    if len(paths) > 1 and self.configuration.replication_path_transport:
+                        connection['net'] = dict({
+                            'transport': f'"{self.configuration.replication_path_transport}"',
+                            'load-balance-paths': 'yes',
+                        }, **net_options)
+                connections.append(connection)
+                link += 1
+        return connections
+
+
+    @staticmethod
+    def __get_secondary_link_mode(replication_devices, replication_mode) -> str:
+        """
+        Returns the least synchronous mode of the ends of a link between secondary backends
+        :param replication_devices: the replication_device entries of both ends
+        :param replication_mode: the replication mode of the resource used by entries without their own mode
+        :return: the replication mode
+        """
+        modes = list(REPLICATION_PROTOCOLS.keys())
+        return min([d.get('replication_mode', replication_mode) for d in replication_devices], key=modes.index)
+
+
+    @staticmethod
+    def __parse_paths(paths) -> list:
+        """
+        Parses the network paths of the link from the replication_device entry,
+        e.g. paths:10.0.1.1=10.0.1.2;10.0.2.1=10.0.2.2
+        :param paths: pairs of the local and the remote address separated by semicolons
+        :return: list of local and remote address pairs
+        """
+        parsed = []
+        for path in filter(None, paths.split(';')):
+            addresses = [address.strip() for address in path.split('=')]
+            if len(addresses) != 2 or not all(addresses):
+                raise exception.InvalidConfigurationValue(option='replication_device:paths', value=paths)
+            parsed.append(addresses)
+        return parsed
+
+
     """
         DRDB resource management
     """
@@ -488,99 +1835,1175 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         """
         all_entries = os.listdir("/dev")
         # Filter for devices containing "drbd" in their name and ending with numbers
-        filtered_devices = fnmatch.filter(all_entries, "drbd[0-9]")
-        allocated = []
+        filtered_devices = fnmatch.filter(all_entries, "drbd[0-9]*")
+        # minors of resources being created have no device yet
+        allocated = set(self._reserved_minors)
         for d in filtered_devices:
-            index = "".join([char for char in d if char.isdigit()])
-            allocated.append(int(index))
-        allocated.sort()
+            index = d[len('drbd'):]
+            if index.isdigit():
+                allocated.add(int(index))
         minor_number: int = 0
-        for m in allocated:
-            if m != minor_number:
-                return minor_number
+        while minor_number in allocated:
             minor_number += 1
+        self._reserved_minors.add(minor_number)
         return minor_number
 
 
-    def __set_drbd_resource_primary(self, resource_id, force=False):
+    def __set_drbd_resource_primary(self, resource_id, force=False):
+        """
+        Sets the local drbd device primary
+        :param resource_id: drbd resource id
+        :param force:
+        :return: None
+        """
+        try:
+            root_helper = utils.get_root_helper()
+            if force:
+                self._execute('drbdadm', 'primary', resource_id, '--force', root_helper=root_helper, run_as_root=True)
+            else:
+                self._execute('drbdadm', 'primary', resource_id, root_helper=root_helper, run_as_root=True)
+            LOG.info(f"The replication role was successfully set as primary for the resource {resource_id}")
+        except processutils.ProcessExecutionError as e:
+            exception_message = (
+                    _(f"Failed to purge volume replication {resource_id}, error message was: %s")
+                    % six.text_type(e.stderr)
+            )
+            LOG.error(exception_message)
+        except Exception as e:
+            LOG.error(f"Failed to initialize replicated volume {resource_id}, an unexpected error occurred: {e}")
+
+
+    def __set_drbd_resources_primary(self, resource_ids, force=False) -> list:
+        """
+        Sets local drbd devices primary with one command, resources are promoted one by one if the batch fails
+        :param resource_ids: drbd resource ids
+        :param force:
+        :return: list of resource ids that were not promoted
+        """
+        root_helper = utils.get_root_helper()
+        args = ['drbdadm', 'primary'] + (['--force'] if force else [])
+        try:
+            self._execute(*args, *resource_ids, root_helper=root_helper, run_as_root=True)
+            LOG.info(f"The replication role was successfully set as primary for {len(resource_ids)} resources")
+            return []
+        except processutils.ProcessExecutionError as e:
+            LOG.warning(f"Failed to promote {len(resource_ids)} resources in one batch, error message was: {e.stderr}")
+
+        failed = []
+        for resource_id in resource_ids:
+            try:
+                self._execute(*args, resource_id, root_helper=root_helper, run_as_root=True)
+            except processutils.ProcessExecutionError as e:
+                LOG.error(f"Failed to set the replication role primary for the resource {resource_id}, "
+                          f"error message was: {e.stderr}")
+                failed.append(resource_id)
+        return failed
+
+
+    @utils.retry(retry_tuple, interval=2, retries=5)
+    def __skipping_initial_resynchronization(self, resource):
+        """
+        Skips initial sync between drbd devices
+        :param resource: resource object
+        :return: None
+        """
+        res_id = resource.get('volume_id')
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('drbdadm', '--clear-bitmap', 'new-current-uuid', res_id, root_helper=root_helper,
+                          run_as_root=True)
+        except processutils.ProcessExecutionError as e:
+            raise ReplicatedVolumeBackendRetryableException(data=str(e))
+        except Exception as e:
+            LOG.error(f"Failed to skip initial resynchronization for volume id {res_id}, an error occurred: {e}")
+            raise ReplicatedVolumeBackendRetryableException(data=str(e))
+
+
+    def __setup_drbd_config(self, resource):
+        """
+        Setups drbd device for replication
+        :param resource: resource object as dict
+        :return: None
+        """
+        res_id = resource.get('volume_id')
+        minor = resource.get('device_minor')
+        config = self.__render_drbd_config(resource)
+
+        try:
+            self.__write_drbd_config(res_id, config)
+            root_helper = utils.get_root_helper()
+            LOG.info(f"Created replicated resource {res_id}, device minor is {minor}")
+            self._execute('drbdadm', 'create-md', res_id, root_helper=root_helper, run_as_root=True)
+            self._execute('drbdadm', 'up', res_id, root_helper=root_helper, run_as_root=True)
+
+            LOG.info(f"Replicated resource {res_id} was successfully started.")
+
+        except IOError as e:
+            LOG.error(f"An I/O error occurred while writing the file /etc/drbd.d/{res_id}.res: {e}")
+        except processutils.ProcessExecutionError as e:
+            exception_message = (
+                    _(f"Failed to purge volume replication {res_id}, error message was: %s")
+                    % six.text_type(e.stderr)
+            )
+            LOG.error(exception_message)
+        except Exception as e:
+            LOG.error(f"Failed to initialize replicated volume {res_id}, an unexpected error occurred: {e}")
+
+
+    @staticmethod
+    def __render_sections(sections) -> str:
+        """
+        Renders resource level sections, e.g. net or disk
+        :param sections: dict of section name and section options
+        :return: rendered sections
+        """
+        rendered = ''
+        for name, section_options in sections.items():
+            if not section_options:
+                continue
+            options = ''.join(SECTION_OPTION.format(name=k, value=v) for k, v in section_options.items())
+            rendered += SECTION.format(name=name, section_options=options)
+        return rendered
+
+
+    def __render_drbd_config(self, resource) -> str:
+        """
+        Renders drbd configuration of the resource. Resources without connections keep the two node floating
+        layout, otherwise every node and connection of the mesh is rendered with its own protocol and options
+        :param resource: resource object as dict
+        :return: drbd configuration
+        """
+        res_id = resource.get('volume_id')
+        minor = resource.get('device_minor')
+        options = self.__render_sections({'options': resource.get('options'), 'disk': resource.get('disk'),
+                                          'net': resource.get('net'), 'handlers': resource.get('handlers')})
+
+        overrides = resource.get('protocol_overrides', {})
+        if not resource.get('connections'):
+            protocol = REPLICATION_PROTOCOLS[next(iter(overrides.values()), resource.get('replication_mode'))]
+            port = resource.get('replication_port')
+            backends = ''
+            for b in resource.get('backends'):
+                backends += BACKEND.format(address=b.get('ip'), port=port, disk=b.get('volume'))
+            return RESOURCE_CONF.format(resource_id=res_id, protocol=protocol, options=options, backends=backends,
+                                        minor=minor).lstrip()
+
+        backends = {b.get('id'): b for b in resource.get('backends')}
+        hosts = ''
+        for b in resource.get('backends'):
+            hosts += MESH_HOST.format(hostname=b.get('hostname'), node_id=b.get('node_id'), disk=b.get('volume'))
+
+        connections = ''
+        for c in resource.get('connections'):
+            a, b = [backends[host] for host in c.get('hosts')]
+            protocol = REPLICATION_PROTOCOLS[overrides.get(self.__get_link_key(*c.get('hosts'))) or
+                                             c.get('replication_mode') or resource.get('replication_mode')]
+            net_options = ''.join(CONNECTION_OPTION.format(name=k, value=v) for k, v in c.get('net', {}).items())
+            if c.get('paths'):
+                paths = ''.join(MESH_PATH.format(host_a=a.get('hostname'), address_a=p['addresses'][0],
+                                                 host_b=b.get('hostname'), address_b=p['addresses'][1],
+                                                 port=p['port']) for p in c.get('paths'))
+                connections += MESH_PATHS_CONNECTION.format(paths=paths, protocol=protocol, net_options=net_options)
+                continue
+            connections += MESH_CONNECTION.format(host_a=a.get('hostname'), address_a=a.get('ip'),
+                                                  host_b=b.get('hostname'), address_b=b.get('ip'),
+                                                  port=c.get('port'), protocol=protocol, net_options=net_options)
+
+        return MESH_RESOURCE_CONF.format(resource_id=res_id, minor=minor, options=options, hosts=hosts,
+                                         connections=connections).lstrip()
+
+
+    @staticmethod
+    def __get_link_key(backend_id, peer_backend_id) -> str:
+        """
+        Returns the key of the link between two backends independent of their order
+        :param backend_id: backend id
+        :param peer_backend_id: peer backend id
+        :return: the link key
+        """
+        return '|'.join(sorted([backend_id, peer_backend_id]))
+
+
+    def __get_link_mode(self, resource, peer_backend_id) -> str:
+        """
+        Returns the configured replication mode of the link between the current backend and the peer
+        :param resource: resource object as dict
+        :param peer_backend_id: peer backend id
+        :return: the replication mode
+        """
+        hosts = {self.configuration.backend_id, peer_backend_id}
+        for c in resource.get('connections', []):
+            if set(c.get('hosts')) == hosts:
+                return c.get('replication_mode') or resource.get('replication_mode')
+        return resource.get('replication_mode')
+
+
+    def __get_drbd_status(self, resource_id=None) -> list:
+        """
+        Returns the state and statistics of drbd resources
+        :param resource_id: drbd resource id, all resources are returned if not specified
+        :return: list of resource states as reported by drbdsetup
+        """
+        args = ['drbdsetup', 'status', '--json', '--statistics']
+        if resource_id is not None:
+            args.insert(2, resource_id)
+        try:
+            root_helper = utils.get_root_helper()
+            out, _err = self._execute(*args, root_helper=root_helper, run_as_root=True)
+            return json.loads(out)
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to get the state of drbd resources, error message was: {e.stderr}")
+        except ValueError as e:
+            LOG.error(f"Failed to parse the state of drbd resources: {e}")
+        return []
+
+
+    def __get_peer_connection(self, resource, resource_status, peer_backend_id):
+        """
+        Finds the drbd connection state to the peer
+        :param resource: resource object as dict
+        :param resource_status: the resource state reported by drbdsetup
+        :param peer_backend_id: peer backend id
+        :return: the connection state or None
+        """
+        connections = resource_status.get('connections', [])
+        if not resource.get('connections'):
+            return connections[0] if len(connections) == 1 else None
+        node_ids = {b.get('id'): b.get('node_id') for b in resource.get('backends')}
+        for connection in connections:
+            if connection.get('peer-node-id') == node_ids.get(peer_backend_id):
+                return connection
+        return None
+
+
+    def __probe_peer_latency(self, secondary_backend):
+        """
+        Measures the round trip time of a heartbeat request to the secondary backend, the heartbeat is sent once
+        and refreshes the cached capacity and health of the backend
+        :param secondary_backend: the replication_device entry
+        :return: the round trip time in milliseconds or None if the backend is unreachable
+        """
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        started = time.monotonic()
+        try:
+            heartbeat = self._do_client_request(api_method='/heartbeat', endpoint=endpoint, http_method='GET',
+                                                timeout=5, retry=False)
+        except ValueError:
+            # backends of older versions answer the heartbeat with plain text, they are reachable but
+            # report no capacity
+            heartbeat = {}
+        except (ReplicatedVolumeBackendRetryableException, requests.exceptions.RequestException) as e:
+            LOG.warning(f"The backend {secondary_backend['backend_id']} didn't respond to the heartbeat: {e}")
+            # an unreachable backend is cached as well, so it's not probed again before the ttl expires
+            with self._peer_status_lock:
+                self._peer_status[secondary_backend['backend_id']] = (time.monotonic(), None)
+            return None
+        finished = time.monotonic()
+        with self._peer_status_lock:
+            self._peer_status[secondary_backend['backend_id']] = (
+                finished, heartbeat if isinstance(heartbeat, dict) else {})
+        return (finished - started) * 1000
+
+
+    def __get_heartbeat(self) -> dict:
+        """
+        Makes the heartbeat response with the cached capacity of the volume group and the health of the backend
+        :return: the heartbeat as dict
+        """
+        heartbeat = {
+            'status': 'alive',
+            'health': {
+                'resources': len(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_META}")),
+                'deleting': len(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_DELETING}")),
+            },
+        }
+        with self._stats_lock:
+            pools = self._stats.get('pools') or []
+            if pools:
+                heartbeat['capacity'] = {
+                    'volume_group': self.configuration.volume_group,
+                    'total_capacity_gb': pools[0].get('total_capacity_gb'),
+                    'free_capacity_gb': pools[0].get('free_capacity_gb'),
+                    'provisioned_capacity_gb': pools[0].get('provisioned_capacity_gb'),
+                }
+        return heartbeat
+
+
+    def __get_peer_status(self) -> dict:
+        """
+        Returns the heartbeats of the secondary backends, heartbeats older than replication_peer_status_ttl are
+        requested again
+        :return: dict of backend id and the heartbeat or None if the backend is unreachable
+        """
+        ttl = self.configuration.replication_peer_status_ttl
+        peer_status = {}
+        for secondary_backend in self.configuration.replication_device or []:
+            backend_id = secondary_backend['backend_id']
+            with self._peer_status_lock:
+                cached = self._peer_status.get(backend_id)
+            if cached is None or time.monotonic() - cached[0] >= ttl:
+                self.__probe_peer_latency(secondary_backend)
+                with self._peer_status_lock:
+                    cached = self._peer_status.get(backend_id)
+            peer_status[backend_id] = cached[1] if cached is not None else None
+        return peer_status
+
+
+    def __sample_resyncs(self):
+        """
+        Follows resyncs of local resources and measures the data skipped by discard-based zero detection as
+        the difference between the out-of-sync data at the start of the resync and the data sent until its end
+        :return: None
+        """
+        syncing = {}
+        for resource_status in self.__get_drbd_status():
+            for connection in resource_status.get('connections', []):
+                for peer_device in connection.get('peer_devices', []):
+                    if peer_device.get('replication-state') != 'SyncSource':
+                        continue
+                    key = (resource_status.get('name'), connection.get('peer-node-id'), peer_device.get('volume'))
+                    syncing[key] = self._resyncs.get(key) or {
+                        'out_of_sync': peer_device.get('out-of-sync', 0),
+                        'sent': peer_device.get('sent', 0),
+                    }
+                    syncing[key]['last_sent'] = peer_device.get('sent', 0)
+
+        for key, resync in self._resyncs.items():
+            if key in syncing:
+                continue
+            transferred = max(resync['last_sent'] - resync['sent'], 0)
+            skipped = max(resync['out_of_sync'] - transferred, 0)
+            self._resync_total_kb += resync['out_of_sync']
+            self._resync_skipped_kb += skipped
+            LOG.info(f"Resync of resource {key[0]} to peer node {key[1]} finished, {transferred} KiB of "
+                     f"{resync['out_of_sync']} KiB out of sync were transferred, {skipped} KiB were skipped "
+                     f"by discard-based zero detection")
+        self._resyncs = syncing
+
+
+    def __sample_link_traffic(self) -> dict:
+        """
+        Sums the network paths and the data sent over the connections of all local resources per peer backend
+        :return: dict of peer backend id and the link state with paths, established paths and sent KiB
+        """
+        status = {r.get('name'): r for r in self.__get_drbd_status()}
+        links = {}
+        for resource in self.__list_resources():
+            resource_status = status.get(resource['volume_id'])
+            if resource_status is None:
+                continue
+            for secondary_backend in self.configuration.replication_device or []:
+                connection = self.__get_peer_connection(resource, resource_status, secondary_backend['backend_id'])
+                if connection is None:
+                    continue
+                link = links.setdefault(secondary_backend['backend_id'],
+                                        {'paths': 0, 'established_paths': 0, 'sent_kb': 0})
+                paths = connection.get('paths', [])
+                link['paths'] += len(paths)
+                link['established_paths'] += sum(1 for path in paths if path.get('established'))
+                link['sent_kb'] += sum(d.get('sent', 0) for d in connection.get('peer_devices', []))
+        return links
+
+
+    def __get_link_paths(self) -> dict:
+        """
+        Reports the path health and the replication throughput of every link since the previous report
+        :return: dict of peer backend id and the link state
+        """
+        now = time.monotonic()
+        links = self.__sample_link_traffic()
+        for peer_backend_id, link in links.items():
+            previous = self._link_traffic.get(peer_backend_id)
+            link['sent_kbps'] = 0
+            if previous is not None and now > previous[0]:
+                # counters of resources that went down are lost, the rate is never negative
+                link['sent_kbps'] = round(max(link['sent_kb'] - previous[1], 0) / (now - previous[0]), 1)
+            self._link_traffic[peer_backend_id] = (now, link['sent_kb'])
+            if link['established_paths'] < link['paths']:
+                LOG.warning(f"{link['paths'] - link['established_paths']} of {link['paths']} network paths to "
+                            f"backend {peer_backend_id} are not established")
+        return links
+
+
+    def __schedule_verifications(self):
+        """
+        Cycles through the resources in ev3_meta and runs online verifications of local primary resources that
+        were not verified within replication_verify_period. Running verifications share replication_verify_max_rate
+        and at most replication_verify_concurrency verifications run at the same time
+        :return: None
+        """
+        states = {r.get('name'): r for r in self.__get_drbd_status()}
+        resources = list(self.__list_resources())
+        if self._verify_findings is None:
+            self._verify_findings = {r['volume_id']: r['verify'].get('out_of_sync_kb', 0)
+                                     for r in resources if 'verify' in r}
+        # forget verifications of deleted resources
+        self._verifying &= {r['volume_id'] for r in resources}
+
+        for resource in resources:
+            if resource['volume_id'] not in self._verifying:
+                continue
+            peer_devices = [d for c in states.get(resource['volume_id'], {}).get('connections', [])
+                            for d in c.get('peer_devices', [])]
+            if any(d.get('replication-state') in ('VerifyS', 'VerifyT') for d in peer_devices):
+                continue
+            self.__finish_verification(resource, sum(d.get('out-of-sync', 0) for d in peer_devices))
+
+        now = time.time()
+        candidates = []
+        for resource in resources:
+            resource_status = states.get(resource['volume_id'])
+            if (resource['volume_id'] in self._verifying or resource_status is None or
+                    resource_status.get('role') != 'Primary' or
+                    now - resource.get('verify', {}).get('finished_at', 0) < self.configuration.replication_verify_period):
+                continue
+            connections = resource_status.get('connections', [])
+            if connections and all(c.get('connection-state') == 'Connected' and
+                                   all(d.get('replication-state') == 'Established' and
+                                       d.get('peer-disk-state') == 'UpToDate' for d in c.get('peer_devices', []))
+                                   for c in connections):
+                candidates.append(resource)
+
+        candidates.sort(key=lambda r: r.get('verify', {}).get('finished_at', 0))
+        slots = self.configuration.replication_verify_concurrency - len(self._verifying)
+        rate = max(self.configuration.replication_verify_max_rate //
+                   max(self.configuration.replication_verify_concurrency, 1), 1)
+        for resource in candidates[:max(slots, 0)]:
+            self.__start_verification(resource, rate)
+
+
+    def __start_verification(self, resource, rate):
+        """
+        Starts the online verification of the resource limited to the rate
+        :param resource: resource object as dict
+        :param rate: the verification rate in KiB/s
+        :return: None
+        """
+        res_id = resource['volume_id']
+        if 'verify-alg' not in resource.get('net', {}):
+            resource.setdefault('net', {})['verify-alg'] = self.configuration.replication_verify_alg
+            if not self.__adjust_replication([resource]):
+                return
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('drbdadm', 'peer-device-options', f"--c-max-rate={rate}k", res_id,
+                          root_helper=root_helper, run_as_root=True)
+            self._execute('drbdadm', 'verify', res_id, root_helper=root_helper, run_as_root=True)
+            self._verifying.add(res_id)
+            LOG.info(f"Online verification of replicated resource {res_id} was started with "
+                     f"{resource['net']['verify-alg']} at {rate} KiB/s")
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to start online verification of replicated resource {res_id}, "
+                      f"error message was: {e.stderr}")
+
+
+    def __finish_verification(self, resource, out_of_sync_kb):
+        """
+        Records the result of the finished online verification, restores the configured resync rate and, if
+        allowed, resyncs the blocks found out of sync
+        :param resource: resource object as dict
+        :param out_of_sync_kb: the data found out of sync in KiB
+        :return: None
+        """
+        res_id = resource['volume_id']
+        self._verifying.discard(res_id)
+        resource['verify'] = {
+            'finished_at': time.time(),
+            'out_of_sync_kb': out_of_sync_kb,
+        }
+        self._verify_findings[res_id] = out_of_sync_kb
+        self.__save_resource_meta(resource)
+        root_helper = utils.get_root_helper()
+        try:
+            self._execute('drbdadm', 'adjust', res_id, root_helper=root_helper, run_as_root=True)
+            if out_of_sync_kb == 0:
+                LOG.info(f"Online verification of replicated resource {res_id} found no differences")
+                return
+            LOG.warning(f"Online verification of replicated resource {res_id} found {out_of_sync_kb} KiB out of sync")
+            if self.configuration.replication_verify_auto_resync:
+                # reconnecting resyncs only the blocks marked out of sync by the verification
+                self._execute('drbdadm', 'disconnect', res_id, root_helper=root_helper, run_as_root=True)
+                self._execute('drbdadm', 'connect', res_id, root_helper=root_helper, run_as_root=True)
+                LOG.info(f"Resync of {out_of_sync_kb} KiB out of sync of replicated resource {res_id} was started")
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to finish online verification of replicated resource {res_id}, "
+                      f"error message was: {e.stderr}")
+
+
+    def __adjust_replication(self, resources) -> bool:
+        """
+        Applies changed resources on all secondary backends with one request per backend and then locally. If a
+        backend fails, the backends that already applied the resources get the saved resources back
+        :param resources: list of resource objects as dict
+        :return: true if all secondary backends applied the resources
+        """
+        # the meta of the current backend is not changed yet and holds the previous resources
+        previous = [r for r in (self.__load_resource_meta(r['volume_id']) for r in resources) if r is not None]
+        adjusted = []
+        for secondary_backend in self.configuration.replication_device or []:
+            # a backend that rejected some resources may have applied the others
+            adjusted.append(secondary_backend)
+            if not self.__request_adjust(secondary_backend, resources):
+                self.__rollback_adjust(adjusted, previous)
+                return False
+
+        failed = {r['volume_id'] for r in resources if not self.__adjust_drbd_resource(r)}
+        if failed:
+            LOG.error(f"Volumes {', '.join(sorted(failed))} were not adjusted, the changes are rolled back")
+            self.__rollback_adjust(adjusted, previous)
+            for resource in previous:
+                if resource['volume_id'] not in failed:
+                    self.__adjust_drbd_resource(resource)
+            return False
+        return True
+
+
+    def __rollback_adjust(self, secondary_backends, previous):
+        """
+        Applies the previous resources on the secondary backends
+        :param secondary_backends: the replication_device entries
+        :param previous: list of previous resource objects as dict
+        :return: None
+        """
+        for backend in secondary_backends:
+            if self.__request_adjust(backend, previous):
+                LOG.info(f"{len(previous)} volume replicas were rolled back on backend {backend['backend_id']}")
+
+
+    def __request_adjust(self, secondary_backend, resources) -> bool:
+        """
+        Requests the secondary backend to apply the resources
+        :param secondary_backend: the replication_device entry
+        :param resources: list of resource objects as dict
+        :return: true if the backend applied the resources
+        """
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        try:
+            result = self._do_client_request(api_method='/adjust_volumes', endpoint=endpoint,
+                                             data={'resources': resources})
+        except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+            LOG.error(f"{len(resources)} volume replicas were not adjusted on backend "
+                      f"{secondary_backend['backend_id']}, an exception occurred: {a.message}")
+            return False
+        if not isinstance(result, dict):
+            LOG.error(f"{len(resources)} volume replicas were not adjusted on backend "
+                      f"{secondary_backend['backend_id']}, the backend responded: {result}")
+            return False
+        return True
+
+
+    def __tune_link_buffers(self):
+        """
+        Measures the round trip time and the throughput of every link and sizes the net buffers to twice the
+        bandwidth-delay product. The throughput is the average of the interval, the highest average decays slowly.
+        A link limited by its buffers sends about a buffer per round trip, so its buffers double with every
+        measurement until the throughput stops growing or drbd's limit is reached. Changed buffers are applied to
+        all resources by drbdadm adjust
+        :return: None
+        """
+        now = time.monotonic()
+        traffic = self.__sample_link_traffic()
+        for secondary_backend in self.configuration.replication_device or []:
+            peer_backend_id = secondary_backend['backend_id']
+            rtt = self.__measure_link_rtt(secondary_backend)
+            link = traffic.get(peer_backend_id)
+            if rtt is None or link is None:
+                continue
+
+            link_buffers = self._link_buffers.get(peer_backend_id)
+            if link_buffers is None:
+                # the throughput is known from the second measurement
+                self._link_buffers[peer_backend_id] = {
+                    'buffers': None, 'peak_kbps': 0.0, 'sampled_at': now, 'sent_kb': link['sent_kb'], 'shrink': 0}
+                continue
+            elapsed = now - link_buffers['sampled_at']
+            rate = max(link['sent_kb'] - link_buffers['sent_kb'], 0) / elapsed if elapsed > 0 else 0
+            # the peak decays slowly, so a quiet interval doesn't shrink the buffers of a busy link
+            link_buffers['peak_kbps'] = max(rate, link_buffers['peak_kbps'] * 0.9)
+            link_buffers['sampled_at'] = now
+            link_buffers['sent_kb'] = link['sent_kb']
+
+            bdp = link_buffers['peak_kbps'] * units.Ki * rtt / 1000
+            max_size = min(self.configuration.replication_buffer_max_size, DRBD_MAX_SOCKET_BUFFER_SIZE)
+            size = self.configuration.replication_buffer_min_size
+            while size < 2 * bdp and size < max_size:
+                size *= 2
+            size = min(size, max_size)
+            max_buffers = min(max(size // (4 * units.Ki), 2048), 131072)
+            buffers = {
+                'sndbuf-size': size,
+                'rcvbuf-size': size,
+                'max-buffers': max_buffers,
+                'max-epoch-size': min(max_buffers, 20000),
+            }
+
+            current = link_buffers['buffers']
+            if current is not None and buffers['sndbuf-size'] == current['sndbuf-size']:
+                link_buffers['shrink'] = 0
+                continue
+            if current is not None and buffers['sndbuf-size'] < current['sndbuf-size']:
+                link_buffers['shrink'] += 1
+                if link_buffers['shrink'] < self.configuration.replication_buffer_autotune_samples:
+                    continue
+            link_buffers['shrink'] = 0
+            link_buffers['buffers'] = buffers
+
+            resources = [r for r in self.__list_resources()
+                         if self.__apply_link_buffers(r, peer_backend_id, buffers)]
+            LOG.info(f"Link to backend {peer_backend_id}: rtt {rtt:.1f} ms, throughput "
+                     f"{link_buffers['peak_kbps']:.0f} KiB/s, bandwidth-delay product {bdp / units.Ki:.0f} KiB, applying {buffers} "
+                     f"to {len(resources)} resources")
+            for batch in self.__batches(resources, self.configuration.replication_bulk_batch_size):
+                self.__adjust_replication(batch)
+
+
+    @staticmethod
+    def __measure_link_rtt(secondary_backend, probes=3):
+        """
+        Measures the round trip time of the link by tcp connects to the ev3 Restful API of the peer, the
+        connect completes after one round trip without any request processing
+        :param secondary_backend: the replication_device entry
+        :param probes: number of connects, the fastest one is taken
+        :return: the round trip time in milliseconds or None if the backend is unreachable
+        """
+        rtts = []
+        for _ in range(probes):
+            started = time.monotonic()
+            try:
+                with socket.create_connection((secondary_backend['ip'], int(secondary_backend['port'])), timeout=5):
+                    rtts.append((time.monotonic() - started) * 1000)
+            except OSError as e:
+                LOG.warning(f"The round trip time to backend {secondary_backend['backend_id']} was not measured: {e}")
+                return None
+        return min(rtts)
+
+
+    def __apply_link_buffers(self, resource, peer_backend_id, buffers) -> bool:
+        """
+        Sets the net buffers of the link to the peer in the resource, net options of the replication_device
+        entry take precedence
+        :param resource: resource object as dict
+        :param peer_backend_id: peer backend id
+        :param buffers: net buffer options
+        :return: true if the resource was changed
+        """
+        replication_device = next((b for b in self.configuration.replication_device or []
+                                   if b['backend_id'] == peer_backend_id), {})
+        configured = self.__get_link_net_options(replication_device)
+        if resource.get('connections'):
+            hosts = {self.configuration.backend_id, peer_backend_id}
+            net = next((c.setdefault('net', {}) for c in resource['connections'] if set(c.get('hosts')) == hosts),
+                       None)
+        elif any(b.get('id') == peer_backend_id for b in resource.get('backends', [])):
+            net = resource.setdefault('net', {})
+        else:
+            net = None
+        if net is None:
+            return False
+        changed = False
+        for name, value in buffers.items():
+            if name not in configured and net.get(name) != value:
+                net[name] = value
+                changed = True
+        return changed
+
+
+    def __reap_deleted_resources(self):
+        """
+        Removes the resources of deleted volumes in batches: stops the local drbd resources, deletes the replicas
+        with one request per secondary backend and removes the local logical volumes. The progress is kept in
+        the resource, so failed steps are retried by the next run
+        :return: None
+        """
+        resources = []
+        for resource_id in sorted(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_DELETING}")):
+            try:
+                with open(self.__get_deleting_resource_path(resource_id), "r") as file:
+                    resources.append(json.load(file))
+            except (IOError, ValueError) as e:
+                LOG.error(f"Failed to load the deleted resource {resource_id}: {e}")
+        if not resources:
+            return
+
+        started = time.monotonic()
+        reaped = 0
+        root_helper = utils.get_root_helper()
+        peer_backend_ids = [b['backend_id'] for b in self.configuration.replication_device or []]
+        for batch in self.__batches(resources, self.configuration.replication_bulk_batch_size):
+            resource_ids = [r['volume_id'] for r in batch if not r.get('reaped')]
+            stopped = set(resource_ids)
+            try:
+                if resource_ids:
+                    self._execute('drbdadm', 'down', *resource_ids, root_helper=root_helper, run_as_root=True)
+            except processutils.ProcessExecutionError as e:
+                # resources that are still running are stopped one by one below
+                LOG.debug(f"Failed to stop a batch of deleted resources: {e.stderr}")
+                running = {r.get('name') for r in self.__get_drbd_status()}
+                stopped = {resource_id for resource_id in resource_ids if resource_id not in running}
+
+            def reap_replicas(secondary_backend):
+                peer_backend_id = secondary_backend['backend_id']
+                pending = [r for r in batch if peer_backend_id not in r.get('reaped_by', [])]
+                if not pending:
+                    return
+                endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+                try:
+                    result = self._do_client_job(api_method='/delete_volumes', endpoint=endpoint,
+                                                 data={'resources': pending})
+                    failed = set(result.get('failed', [])) if isinstance(result, dict) else None
+                except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                    LOG.error(f"{len(pending)} deleted volume replicas were not removed on backend "
+                              f"{peer_backend_id}, an exception occurred: {a.message}")
+                    return
+                for resource in pending:
+                    if failed is not None and resource['volume_id'] not in failed:
+                        resource.setdefault('reaped_by', []).append(peer_backend_id)
+
+            # the secondary backends remove their replicas while the local logical volumes are removed
+            secondary_backends = self.configuration.replication_device or []
+            with futures.ThreadPoolExecutor(max_workers=max(len(secondary_backends), 1)) as executor:
+                remote = [executor.submit(reap_replicas, b) for b in secondary_backends]
+                for resource in batch:
+                    if not resource.get('reaped'):
+                        resource['reaped'] = self.__remove_volume(resource,
+                                                                  down=resource['volume_id'] not in stopped)
+                for f in remote:
+                    f.result()
+
+            for resource in batch:
+                path = self.__get_deleting_resource_path(resource['volume_id'])
+                if resource['reaped'] and set(peer_backend_ids) <= set(resource.get('reaped_by', [])):
+                    os.remove(path)
+                    reaped += 1
+                else:
+                    with open(path, "w") as file:
+                        json.dump(resource, file, indent=4)
+
+        LOG.info(f"The reaper removed {reaped} of {len(resources)} deleted resources in "
+                 f"{time.monotonic() - started:.1f}s")
+
+
+    def __remove_volume(self, resource, down=True) -> bool:
+        """
+        Stops the drbd resource and removes the logical volume of the deleted volume, the capacity is released
+        when the logical volume is removed
+        :param resource: resource object as dict
+        :param down: false if the drbd resource is already stopped
+        :return: true if the resource and the logical volume are removed
+        """
+        if not self.__remove_drbd_config(resource, down=down):
+            return False
+        volume = {
+            'id': resource['volume_id'],
+            'name': resource['volume_name'],
+            'size': resource.get('volume_size', 0),
+        }
+        try:
+            if not self._volume_not_present(volume['name']):
+                self._delete_volume(volume)
+                self.__account_capacity(-volume['size'], volumes=-1)
+        except Exception as e:
+            LOG.error(f"Failed to remove the logical volume of deleted volume {volume['id']}, an error occurred: {e}")
+            return False
+        return True
+
+
+    def __delete_replicas(self, request):
+        """
+        Deletes the volume replicas requested by the reaper of the primary backend
+        :param request: the list of resources
+        :return: the ids of replicas that were not deleted
+        """
+        failed = []
+        for resource in request['resources']:
+            try:
+                self.__delete_replica(resource)
+            except Exception as e:
+                LOG.error(f"Failed to delete the volume replica {resource['volume_id']}, an error occurred: {e}")
+                failed.append(resource['volume_id'])
+        return {'failed': failed}
+
+
+    def __get_warm_pool_config(self) -> dict:
+        """
+        Parses the warm pool entries
+        :return: dict of the pool key type:size and the number of resources
+        """
+        pool = {}
+        for entry in self.configuration.replication_warm_pool or []:
+            try:
+                volume_type, size, count = entry.rsplit(':', 2)
+                pool[f"{volume_type}:{int(size)}"] = int(count)
+            except ValueError:
+                raise exception.InvalidConfigurationValue(option='replication_warm_pool', value=entry)
+        return pool
+
+
+    @staticmethod
+    def __get_pooled_resource_path(resource_id):
+        """
+        Returns the path to the pre-provisioned resource of the warm pool
+        :param resource_id: resource id
+        :return: the path to the resource
+        """
+        return f"{CONF.get('state_path')}/{RESOURCE_POOL}/{resource_id}"
+
+
+    def __list_pooled_resources(self) -> list:
+        """
+        Loads the pre-provisioned resources of the warm pool
+        :return: list of resource objects as dict
+        """
+        resources = []
+        for resource_id in sorted(os.listdir(f"{CONF.get('state_path')}/{RESOURCE_POOL}")):
+            try:
+                with open(self.__get_pooled_resource_path(resource_id), "r") as file:
+                    resources.append(json.load(file))
+            except (IOError, ValueError) as e:
+                LOG.warning(f"Failed to load the pooled resource {resource_id}: {e}")
+        return resources
+
+
+    def __claim_pooled_resource(self, volume):
+        """
+        Takes a pre-provisioned resource of the volume type and size out of the warm pool
+        :param volume: the volume object
+        :return: resource object as dict or None if the pool has no matching resource
+        """
+        if not self.configuration.replication_warm_pool:
+            return None
+        keys = {f"{volume['volume_type_id']}:{volume['size']}"}
+        volume_type = getattr(volume, 'volume_type', None)
+        if volume_type is not None:
+            keys.add(f"{volume_type.name}:{volume['size']}")
+        with self._pool_lock:
+            for resource in self.__list_pooled_resources():
+                if resource.get('pool_key') in keys:
+                    os.remove(self.__get_pooled_resource_path(resource['volume_id']))
+                    return resource
+        LOG.info(f"The warm pool has no resource for the volume {volume['id']} of {volume['size']}G")
+        return None
+
+
+    def __bind_pooled_resource(self, pooled, volume):
+        """
+        Binds the pre-provisioned resource to the volume locally and then on all secondary backends at the same
+        time: the logical volumes and the drbd resources are renamed, the device minor and ports are kept
+        :param pooled: the pooled resource object as dict
+        :param volume: the volume object
+        :return: model update or None if the resource was not bound locally
+        """
+        started = time.monotonic()
+        resource = json.loads(json.dumps(pooled))
+        resource.pop('pool_key', None)
+        resource['volume_id'] = volume['id']
+        resource['volume_name'] = volume['name']
+        for b in resource['backends']:
+            b['volume'] = f"{os.path.dirname(b['volume'])}/{volume['name']}"
+        for peer_backend_id, link_buffers in self._link_buffers.items():
+            if link_buffers['buffers'] is not None:
+                self.__apply_link_buffers(resource, peer_backend_id, link_buffers['buffers'])
+        bind_info = {'pooled': pooled, 'resource': resource}
+
+        def bind(secondary_backend):
+            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+            try:
+                self._do_client_job(api_method='/bind_volume', endpoint=endpoint, data=bind_info)
+                return True
+            except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                LOG.error(f"The pooled resource {pooled['volume_id']} was not bound to the volume {volume['id']} "
+                          f"on backend {secondary_backend['backend_id']}, an exception occurred: {a.message}")
+            return False
+
+        # the secondary backends are renamed only after the local rename succeeded, otherwise the
+        # volume is created from scratch and the pooled resource must keep its name everywhere
+        try:
+            self.__bind_replica(bind_info)
+        except Exception as e:
+            LOG.error(f"The pooled resource {pooled['volume_id']} was not bound to the volume {volume['id']}, "
+                      f"an error occurred: {e}")
+            if (self._volume_not_present(pooled['volume_name']) and
+                    not self._volume_not_present(resource['volume_name'])):
+                # the volume is created from scratch with this name, the reaper removes the pooled one
+                self.vg.rename_volume(resource['volume_name'], pooled['volume_name'])
+            # the reaper removes the pooled resource on all backends
+            with open(self.__get_deleting_resource_path(pooled['volume_id']), "w") as file:
+                json.dump(pooled, file, indent=4)
+            return None
+
+        secondary_backends = self.configuration.replication_device or []
+        bound = True
+        if secondary_backends:
+            with futures.ThreadPoolExecutor(max_workers=len(secondary_backends)) as executor:
+                results = list(executor.map(bind, secondary_backends))
+            bound = all(results)
+            if not bound:
+                # the backends that failed may still hold the replica under the pooled name, the reaper removes
+                # it there while the replicas under the volume name are removed with the volume
+                pooled = dict(pooled, reaped=True,
+                              reaped_by=[b['backend_id'] for b, r in zip(secondary_backends, results) if r])
+                with open(self.__get_deleting_resource_path(pooled['volume_id']), "w") as file:
+                    json.dump(pooled, file, indent=4)
+
+        LOG.info(f"The pooled resource {pooled['volume_id']} was bound to the volume {volume['id']} in "
+                 f"{time.monotonic() - started:.2f}s")
+        return {
+            'replication_status': (fields.ReplicationStatus.ENABLED if bound
+                                   else fields.ReplicationStatus.ERROR),
+            'replication_driver_data': f"device_minor:{resource['device_minor']}",
+            'provider_id': self.configuration.backend_id
+        }
+
+
+    def __bind_replica(self, bind_info):
+        """
+        Renames the logical volume and the drbd resource of the pooled resource after the volume. The resource is
+        stopped while its disk is renamed, so drbd never detaches a disk of a running resource; the metadata is
+        kept and the peers reconnect without a resync
+        :param bind_info: the pooled resource and the bound resource
+        :return: empty result
+        """
+        pooled = bind_info['pooled']
+        resource = bind_info['resource']
+        root_helper = utils.get_root_helper()
+        # drbd peers don't exchange resource names, so every backend renames its resource on its own
+        self._execute('drbdadm', 'down', pooled['volume_id'], root_helper=root_helper, run_as_root=True)
+        self.vg.rename_volume(pooled['volume_name'], resource['volume_name'])
+        self.__write_drbd_config(resource['volume_id'], self.__render_drbd_config(resource))
+        if os.path.exists(f"/etc/drbd.d/{pooled['volume_id']}.res"):
+            os.remove(f"/etc/drbd.d/{pooled['volume_id']}.res")
+        self.__delete_resource_meta(pooled)
+        self.__save_resource_meta(resource)
+        self._execute('drbdadm', 'up', resource['volume_id'], root_helper=root_helper, run_as_root=True)
+        LOG.info(f"The pooled resource {pooled['volume_id']} was bound to the volume {resource['volume_id']}")
+        return {}
+
+
+    def __refill_warm_pool(self):
+        """
+        Creates the missing pre-provisioned resources of the warm pool one by one and hands the resources that
+        are no longer configured over to the reaper
+        :return: None
+        """
+        pool = self.__get_warm_pool_config()
+        counts = collections.Counter()
+        with self._pool_lock:
+            for resource in self.__list_pooled_resources():
+                key = resource.get('pool_key')
+                if counts[key] < pool.get(key, 0):
+                    counts[key] += 1
+                    continue
+                os.rename(self.__get_pooled_resource_path(resource['volume_id']),
+                          self.__get_deleting_resource_path(resource['volume_id']))
+                LOG.info(f"The pooled resource {resource['volume_id']} of {key} is no longer needed")
+
+        ctxt = cinder_context.get_admin_context()
+        for key, count in pool.items():
+            if counts[key] >= count:
+                continue
+            # a failing volume type or create doesn't stop the refill of the other keys
+            try:
+                self.__refill_warm_pool_key(ctxt, key, count - counts[key])
+            except Exception as e:
+                LOG.error(f"The warm pool of {key} was not refilled, an error occurred: {e}")
+
+
+    def __refill_warm_pool_key(self, ctxt, key, missing):
         """
-        Sets the local drbd device primary
-        :param resource_id: drbd resource id
-        :param force:
+        Creates the missing pre-provisioned resources of a volume type and size
+        :param ctxt: the openstack context
+        :param key: the volume type and the size
+        :param missing: the number of missing resources
         :return: None
         """
-        try:
-            root_helper = utils.get_root_helper()
-            if force:
-                self._execute('drbdadm', 'primary', resource_id, '--force', root_helper=root_helper, run_as_root=True)
+        volume_type_id, size = key.rsplit(':', 1)
+        volume_type = objects.VolumeType.get_by_name_or_id(ctxt, volume_type_id)
+        for i in range(missing):
+            # _name_id is set, otherwise volume.name lazy-loads it and fails for a volume that isn't in the database
+            volume = objects.Volume(context=ctxt, id=str(uuid.uuid4()), _name_id=None, size=int(size),
+                                    volume_type_id=volume_type.id, volume_type=volume_type)
+            model_update = self.__create_replicated_volume(volume)
+            resource = self.__load_resource_meta(volume.id)
+            if resource is None:
+                LOG.error(f"The pooled resource {volume.id} of {key} has no meta, removing it")
+                with open(self.__get_deleting_resource_path(volume.id), "w") as file:
+                    json.dump({'volume_id': volume.id, 'volume_name': volume.name, 'volume_size': volume.size},
+                              file, indent=4)
+                continue
+            resource['pool_key'] = key
+            if model_update.get('replication_status') != fields.ReplicationStatus.ENABLED:
+                LOG.warning(f"The pooled resource {volume.id} of {key} is not replicated, removing it")
+                path = self.__get_deleting_resource_path(volume.id)
             else:
-                self._execute('drbdadm', 'primary', resource_id, root_helper=root_helper, run_as_root=True)
-            LOG.info(f"The replication role was successfully set as primary for the resource {resource_id}")
-        except processutils.ProcessExecutionError as e:
-            exception_message = (
-                    _(f"Failed to purge volume replication {resource_id}, error message was: %s")
-                    % six.text_type(e.stderr)
-            )
-            LOG.error(exception_message)
-        except Exception as e:
-            LOG.error(f"Failed to initialize replicated volume {resource_id}, an unexpected error occurred: {e}")
+                path = self.__get_pooled_resource_path(volume.id)
+            with open(path, "w") as file:
+                json.dump(resource, file, indent=4)
+            self.__delete_resource_meta(resource)
+        LOG.info(f"The warm pool of {key} was refilled with {missing} resources")
 
 
-    @utils.retry(retry_tuple, interval=2, retries=5)
-    def __skipping_initial_resynchronization(self, resource):
+    def __run_periodically(self, task, interval):
         """
-        Skips initial sync between drbd devices
-        :param resource: resource object
+        Runs the task in a background thread with the interval between runs
+        :param task: the callable
+        :param interval: interval in seconds
         :return: None
         """
-        res_id = resource.get('volume_id')
-        try:
-            root_helper = utils.get_root_helper()
-            self._execute('drbdadm', '--clear-bitmap', 'new-current-uuid', res_id, root_helper=root_helper,
-                          run_as_root=True)
-        except processutils.ProcessExecutionError as e:
-            raise ReplicatedVolumeBackendRetryableException(data=str(e))
-        except Exception as e:
-            LOG.error(f"Failed to skip initial resynchronization for volume id {res_id}, an error occurred: {e}")
-            raise ReplicatedVolumeBackendRetryableException(data=str(e))
+        def run(log: logging):
+            while True:
+                time.sleep(interval)
+                try:
+                    task()
+                except Exception as e:
+                    log.error(f"The periodic task {task.__name__} failed, an unexpected error occurred: {e}")
+        thread = Thread(target=run, args=(LOG,))
+        thread.daemon = True
+        thread.start()
 
 
-    def __setup_drbd_config(self, resource):
+    def __adapt_replication_protocols(self):
         """
-        Setups drbd device for replication
-        :param resource: resource object as dict
+        Samples peer latency and pending writes and switches congested full-sync links of local primary resources
+        to async. Switched links are restored once the latency and pending writes stay below
+        replication_adaptive_restore_ratio of the thresholds and the peer is in sync
         :return: None
         """
-        res_id = resource.get('volume_id')
-        protocol = REPLICATION_PROTOCOLS[resource.get('replication_mode')]
-        minor = resource.get('device_minor')
-        port = resource.get('replication_port')
+        latency_threshold = self.configuration.replication_adaptive_latency_threshold
+        pending_threshold = self.configuration.replication_adaptive_pending_threshold
+        restore_ratio = self.configuration.replication_adaptive_restore_ratio
+
+        latencies = {}
+        for b in self.configuration.replication_device or []:
+            latencies[b['backend_id']] = self.__probe_peer_latency(b)
+        states = {r.get('name'): r for r in self.__get_drbd_status()}
+
+        switches = collections.defaultdict(list)
+        for resource in self.__list_resources():
+            resource_status = states.get(resource['volume_id'])
+            if resource_status is None or resource_status.get('role') != 'Primary':
+                continue
+            for b in resource.get('backends'):
+                peer_backend_id = b.get('id')
+                if peer_backend_id not in latencies:
+                    # only links to configured replication devices can be adjusted on both ends
+                    continue
+                connection = self.__get_peer_connection(resource, resource_status, peer_backend_id)
+                if connection is None:
+                    continue
+                link_key = self.__get_link_key(self.configuration.backend_id, peer_backend_id)
+                switched = link_key in resource.get('protocol_overrides', {})
+                if not switched and self.__get_link_mode(resource, peer_backend_id) != 'full-sync':
+                    continue
+
+                peer_devices = connection.get('peer_devices', [])
+                pending = sum(d.get('pending', 0) + d.get('unacked', 0) for d in peer_devices)
+                latency = latencies.get(peer_backend_id)
+                sample_key = (resource['volume_id'], link_key)
+                congested_samples, restored_samples = self._adaptive_samples.get(sample_key, (0, 0))
+
+                if not switched:
+                    congested = (connection.get('congested', False) or pending > pending_threshold or
+                                 (latency is not None and latency > latency_threshold))
+                    congested_samples = congested_samples + 1 if congested else 0
+                    if congested_samples >= self.configuration.replication_adaptive_switch_samples:
+                        switches[peer_backend_id].append((resource, link_key, 'async',
+                                                          f"latency {latency} ms, {pending} pending requests"))
+                        congested_samples = 0
+                else:
+                    restored = (connection.get('connection-state') == 'Connected' and
+                                pending <= pending_threshold * restore_ratio and
+                                (latency is None or latency <= latency_threshold * restore_ratio) and
+                                all(d.get('peer-disk-state') == 'UpToDate' and d.get('out-of-sync', 0) == 0
+                                    for d in peer_devices))
+                    restored_samples = restored_samples + 1 if restored else 0
+                    if restored_samples >= self.configuration.replication_adaptive_restore_samples:
+                        switches[peer_backend_id].append((resource, link_key, None,
+                                                          f"latency {latency} ms, replica is in sync"))
+                        restored_samples = 0
+                self._adaptive_samples[sample_key] = (congested_samples, restored_samples)
+
+        for peer_backend_id, resource_switches in switches.items():
+            self.__switch_link_protocols(peer_backend_id, resource_switches)
+
+
+    def __switch_link_protocols(self, peer_backend_id, resource_switches):
+        """
+        Applies protocol overrides of links to the peer on the peer first and then on the current backend
+        :param peer_backend_id: peer backend id
+        :param resource_switches: list of tuples of resource, link key, replication mode or None to restore and reason
+        :return: None
+        """
+        resources = []
+        for resource, link_key, replication_mode, reason in resource_switches:
+            overrides = resource.setdefault('protocol_overrides', {})
+            if replication_mode is None:
+                overrides.pop(link_key, None)
+            else:
+                overrides[link_key] = replication_mode
+            resources.append(resource)
 
-        backends = ''
-        for b in resource.get('backends'):
-            backends += BACKEND.format(address=b.get('ip'), port=port, disk=b.get('volume'))
+        secondary_backend = next(b for b in self.configuration.replication_device
+                                 if b['backend_id'] == peer_backend_id)
+        endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+        try:
+            result = self._do_client_request(api_method='/adjust_volumes', endpoint=endpoint,
+                                             data={'resources': resources})
+        except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+            LOG.error(f"Replication protocols of {len(resources)} volumes were not switched on backend "
+                      f"{peer_backend_id}, an exception occurred: {a.message}")
+            return
+        if not isinstance(result, dict):
+            # the backend rejected the request, the current backend keeps the protocols of the peer
+            LOG.error(f"Replication protocols of {len(resources)} volumes were not switched on backend "
+                      f"{peer_backend_id}, the backend responded: {result}")
+            return
+
+        for resource, link_key, replication_mode, reason in resource_switches:
+            if not self.__adjust_drbd_resource(resource):
+                continue
+            event = {
+                'time': datetime.datetime.now().isoformat(),
+                'volume_id': resource['volume_id'],
+                'peer': peer_backend_id,
+                'replication_mode': replication_mode or self.__get_link_mode(resource, peer_backend_id),
+                'reason': reason,
+            }
+            self._protocol_switch_events.append(event)
+            if replication_mode is None:
+                LOG.info(f"Replication of volume {resource['volume_id']} to {peer_backend_id} was switched back "
+                         f"to {event['replication_mode']}: {reason}")
+            else:
+                LOG.warning(f"Replication of volume {resource['volume_id']} to {peer_backend_id} was temporarily "
+                            f"switched to {replication_mode}: {reason}")
 
-        config = RESOURCE_CONF.format(resource_id=res_id, protocol=protocol, backends=backends, minor=minor).lstrip()
 
+    def __adjust_drbd_resource(self, resource) -> bool:
+        """
+        Saves the resource, rewrites its drbd configuration and applies the changes to the running resource. If
+        drbd rejects the changes, the previous resource and configuration are restored
+        :param resource: resource object as dict
+        :return: true if the changes were applied
+        """
+        res_id = resource.get('volume_id')
+        previous = self.__load_resource_meta(res_id)
+        self.__save_resource_meta(resource)
+        self.__write_drbd_config(res_id, self.__render_drbd_config(resource))
         try:
-            self.__write_drbd_config(res_id, config)
             root_helper = utils.get_root_helper()
-            LOG.info(f"Created replicated resource {res_id}, device minor is {minor}")
-            self._execute('drbdadm', 'create-md', res_id, root_helper=root_helper, run_as_root=True)
-            self._execute('drbdadm', 'up', res_id, root_helper=root_helper, run_as_root=True)
-
-            LOG.info(f"Replicated resource {res_id} was successfully started.")
-
-        except IOError as e:
-            LOG.error(f"An I/O error occurred while writing the file /etc/drbd.d/{res_id}.res: {e}")
+            self._execute('drbdadm', 'adjust', res_id, root_helper=root_helper, run_as_root=True)
+            LOG.info(f"Replicated resource {res_id} was successfully adjusted.")
+            return True
         except processutils.ProcessExecutionError as e:
             exception_message = (
-                    _(f"Failed to purge volume replication {res_id}, error message was: %s")
+                    _(f"Failed to adjust replicated resource {res_id}, error message was: %s")
                     % six.text_type(e.stderr)
             )
             LOG.error(exception_message)
-        except Exception as e:
-            LOG.error(f"Failed to initialize replicated volume {res_id}, an unexpected error occurred: {e}")
+        if previous is not None:
+            # the meta and the configuration keep describing the running resource
+            self.__save_resource_meta(previous)
+            self.__write_drbd_config(res_id, self.__render_drbd_config(previous))
+        return False
 
 
     @staticmethod
@@ -604,10 +3027,11 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                 os.remove(tmp_path)
             raise e
 
-    def __remove_drbd_config(self, resource):
+    def __remove_drbd_config(self, resource, down=True):
         """
         Stops drbd replication and removes drbd configuration
         :param resource: resource object as a dict
+        :param down: false if the drbd resource is already stopped
         :return: returns true on success
         """
         root_helper = utils.get_root_helper()
@@ -616,10 +3040,11 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             resource_path = f"/etc/drbd.d/{resource_id}.res"
 
             if os.path.exists(resource_path):
-                self._execute(
-                    'drbdadm', 'down', resource_id,
-                    root_helper=root_helper, run_as_root=True
-                )
+                if down:
+                    self._execute(
+                        'drbdadm', 'down', resource_id,
+                        root_helper=root_helper, run_as_root=True
+                    )
                 os.remove(resource_path)
                 if os.path.exists(f"/dev/drbd/by-res/{resource_id}"):
                     os.unlink(f"/dev/drbd/by-res/{resource_id}/0")
@@ -656,11 +3081,215 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         ISCSi block
     """
     def local_path(self, volume, vg=None):
-        with open(f"{CONF.get('state_path')}/{RESOURCE_META}/{volume.id}", "r") as file:
+        resource_path = self.__get_resource_path(volume['id'])
+        if not os.path.exists(resource_path):
+            # snapshots and volumes without replication are plain logical volumes
+            return super().local_path(volume, vg)
+        with open(resource_path, "r") as file:
             resource = json.load(file)
             return f"/dev/drbd{resource.get('device_minor')}"
 
 
+    def _clear_volume(self, volume, is_snapshot=False):
+        """
+        Wipes the backing logical volume instead of the drbd device, so the wipe is never replicated and every
+        backend wipes only its own copy. Thin volumes are discarded, thick volumes are cleared with a limited
+        number of concurrent wipes and a bandwidth limit
+        :param volume: the volume or snapshot object
+        :param is_snapshot: true if a snapshot is cleared
+        :return: None
+        """
+        if is_snapshot:
+            return super()._clear_volume(volume, is_snapshot)
+
+        size_in_g = volume.get('volume_size') or volume.get('size')
+        if size_in_g is None:
+            msg = (_("Size for volume: %s not found, cannot secure delete.") % volume['id'])
+            LOG.error(msg)
+            raise exception.InvalidParameterValue(msg)
+
+        dev_path = LVMVolumeDriver.local_path(self, volume)
+        if os.path.exists(f"/etc/drbd.d/{volume['id']}.res"):
+            # a running drbd resource would replicate the zeroes
+            self.__remove_drbd_config({'volume_id': volume['id']})
+        if not os.path.exists(dev_path):
+            msg = (_('Volume device file path %s does not exist.') % dev_path)
+            LOG.error(msg)
+            raise exception.VolumeBackendAPIException(data=msg)
+
+        started = time.monotonic()
+        with self._clear_slots:
+            if self.configuration.lvm_type == 'thin':
+                try:
+                    self._execute('blkdiscard', dev_path, root_helper=utils.get_root_helper(), run_as_root=True)
+                except processutils.ProcessExecutionError as e:
+                    LOG.warning(f"Failed to discard the volume {volume['id']}, error message was: {e.stderr}")
+            else:
+                # clear_volume expects sizes in MiB
+                volume_utils.clear_volume(size_in_g * units.Ki, dev_path,
+                                          volume_clear=self.configuration.volume_clear,
+                                          volume_clear_size=self.configuration.volume_clear_size,
+                                          volume_clear_ionice=self.configuration.volume_clear_ionice,
+                                          throttle=self._clear_throttle)
+        LOG.info(f"The volume {volume['id']} was cleared in {time.monotonic() - started:.1f}s")
+
+
+    def _delete_volume(self, volume, is_snapshot=False):
+        # the lvm driver doesn't clear thin volumes, their blocks are discarded before they return to the pool
+        if not is_snapshot and self.configuration.lvm_type == 'thin' and self.configuration.volume_clear != 'none':
+            self._clear_volume(volume)
+        super()._delete_volume(volume, is_snapshot)
+
+
+    @timed
+    def copy_image_to_volume(self, context, volume, image_service, image_id, disable_sparse=False):
+        """
+        Fetches the image in its own format, verifies it as cinder does and converts it straight onto the drbd
+        device from the disk format declared by glance, only the data is written. Zeroed ranges are written as zeroes which drbd replicates as discards, or skipped if the volume
+        was never written
+        :param context: openstack context
+        :param volume: the volume object
+        :param image_service: the image service
+        :param image_id: the image id
+        :param disable_sparse: copies the whole image as the lvm driver does
+        :return: None
+        """
+        sparse_size = self.configuration.replication_image_copy_sparse_size
+        if disable_sparse or sparse_size <= 0:
+            return super().copy_image_to_volume(context, volume, image_service, image_id,
+                                                disable_sparse=disable_sparse)
+
+        resource = self.__load_resource_meta(volume['id'])
+        zeroed = resource is not None and resource.get('zeroed', False)
+        device = self.local_path(volume)
+        with image_utils.temporary_file(prefix='ev3-image-') as tmp:
+            # the image is kept in its own format, so it's written once and needs no scratch space of its raw size.
+            # cinder's verification rejects backing files, qcow2 data files, vmdk extents and images whose
+            # content doesn't match the disk format of glance
+            image_meta = image_service.show(context, image_id)
+            src_format = image_utils.fixup_disk_format(image_meta['disk_format'])
+            image_utils.fetch_verify_image(context, image_service, image_id, tmp)
+            info = image_utils.qemu_img_info(tmp, run_as_root=True)
+            image_utils.check_image_format(tmp, src_format=src_format, image_id=image_id, data=info,
+                                           run_as_root=True)
+            if info.file_format != src_format:
+                raise exception.ImageUnacceptable(
+                    image_id=image_id,
+                    reason=_("the image content is %(fmt)s, glance declares %(src)s") % {'fmt': info.file_format,
+                                                                                        'src': src_format})
+            image_utils.check_virtual_size(info.virtual_size, volume['size'], image_id)
+            data_bytes, image_bytes = self.__get_image_data_size(tmp, src_format)
+
+            started = time.monotonic()
+            cmd = ['qemu-img', 'convert', '-f', src_format, '-O', 'raw', '-n', '-t', 'none',
+                   '-S', str(sparse_size)]
+            if zeroed:
+                cmd.append('--target-is-zero')
+            self._execute(*cmd, tmp, device, root_helper=utils.get_root_helper(), run_as_root=True)
+
+        if resource is not None and zeroed:
+            resource['zeroed'] = False
+            self.__save_resource_meta(resource)
+        LOG.info(f"The image {image_id} was copied to the volume {volume['id']} in "
+                 f"{time.monotonic() - started:.1f}s, {data_bytes // units.Mi} of {image_bytes // units.Mi} MiB "
+                 f"were written, the rest was {'skipped' if zeroed else 'discarded'}")
+
+
+    def __get_image_data_size(self, path, image_format):
+        """
+        Counts the allocated non-zero bytes of the image
+        :param path: path to the image
+        :param image_format: the image format
+        :return: tuple of data bytes and image bytes
+        """
+        data_bytes = image_bytes = 0
+        try:
+            out, err = self._execute('qemu-img', 'map', '-f', image_format, '--output=json', path)
+            for extent in json.loads(out):
+                image_bytes += extent['length']
+                if extent.get('data') and not extent.get('zero'):
+                    data_bytes += extent['length']
+        except (processutils.ProcessExecutionError, ValueError, KeyError) as e:
+            LOG.warning(f"Failed to map the image {path}, an error occurred: {e}")
+        return data_bytes, image_bytes
+
+
+    @timed
+    def update_provider_info(self, volumes, snapshots):
+        """
+        Restores exports of all in-use volumes in bulk before the volume manager ensures them one by one
+        :param volumes: the volumes of the service
+        :param snapshots: the snapshots of the service
+        :return: no provider info updates
+        """
+        self.__restore_exports([v for v in volumes if v['status'] == 'in-use'])
+        return None, None
+
+
+    def __restore_exports(self, volumes):
+        """
+        Promotes drbd resources and activates logical volumes in batches, then restores iscsi targets with
+        bounded parallelism. Restored model updates are returned later by ensure_export
+        :param volumes: cinder volumes
+        :return: None
+        """
+        if not volumes:
+            return
+        started = time.monotonic()
+        batch_size = self.configuration.replication_bulk_batch_size
+        workers = self.configuration.replication_bulk_workers
+        volumes = [v for v in volumes if os.path.exists(self.__get_resource_path(v['id']))]
+        failed = set(self.__promote_resources([v['id'] for v in volumes]))
+        promoted = time.monotonic()
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            volumes = [v for v in volumes if v['id'] not in failed]
+            list(executor.map(self.__activate_lvs, self.__batches([v['name'] for v in volumes], batch_size)))
+            activated = time.monotonic()
+
+            ctxt = cinder_context.get_admin_context()
+            def restore(volume):
+                try:
+                    model_update = self.target_driver.ensure_export(ctxt, volume, self.local_path(volume))
+                    self._restored_exports[volume['id']] = model_update
+                except Exception as e:
+                    LOG.error(f"Failed to restore the export of volume {volume['id']}, an error occurred: {e}")
+            list(executor.map(restore, volumes))
+
+        finished = time.monotonic()
+        LOG.info(f"Exports of {len(self._restored_exports)} of {len(volumes) + len(failed)} volumes were restored "
+                 f"in {finished - started:.1f}s (promote {promoted - started:.1f}s, activate {activated - promoted:.1f}s, "
+                 f"targets {finished - activated:.1f}s)")
+
+
+    @staticmethod
+    def __batches(items, batch_size):
+        """
+        Splits items into batches
+        :param items: list of items
+        :param batch_size: maximum size of a batch
+        :return: list of batches
+        """
+        batch_size = max(batch_size, 1)
+        return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+    def __activate_lvs(self, volume_names):
+        """
+        Activates logical volumes of the volume group with one command
+        :param volume_names: logical volume names
+        :return: None
+        """
+        lvs = [f"{self.configuration.volume_group}/{name}" for name in volume_names]
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('lvchange', '-a', 'y', '--yes', *lvs, root_helper=root_helper, run_as_root=True)
+        except processutils.ProcessExecutionError as e:
+            LOG.warning(f"Failed to activate {len(lvs)} logical volumes in one batch, error message was: {e.stderr}")
+            for name in volume_names:
+                self.vg.activate_lv(name)
+
+
+    @timed
     def ensure_export(self, context, volume):
         """
         Ensures iscsi export
@@ -668,6 +3297,9 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         :param volume: cinder volume
         :return: dict of model update
         """
+        if volume['id'] in self._restored_exports:
+            return self._restored_exports.pop(volume['id'])
+
         LOG.info(str(volume))
         self.__set_drbd_resource_primary(volume['id'])
 
@@ -679,6 +3311,7 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         return model_update
 
 
+    @timed
     def create_export(self, context, volume, connector, vg=None):
         """
         Creates an iscsi export
@@ -701,14 +3334,304 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             context,
             volume,
             volume_path)
+        resource = self.__load_resource_meta(volume['id'])
+        if resource is not None and resource.get('dual_primary'):
+            self.__set_unit_serial(volume)
         return {'provider_location': export_info['location'],
                 'provider_auth': export_info['auth'], }
 
 
+    @timed
+    def initialize_connection(self, volume, connector):
+        """
+        Initializes the connection. Dual-primary volumes are also exported by the secondary backends and their
+        portals are added to the connection info, so multipath initiators use all storage nodes
+        :param volume: cinder volume
+        :param connector: the connector
+        :return: the connection info
+        """
+        connection_info = super().initialize_connection(volume, connector)
+        resource = self.__load_resource_meta(volume['id'])
+        data = connection_info.get('data', {})
+        portals = data.get('target_portals') or [data.get('target_portal')]
+        self.__add_portal_connections(volume['id'], connector, portals)
+        if resource is not None and resource.get('zeroed'):
+            # an attached volume is written by the instance, images are no longer copied onto zeroes
+            resource['zeroed'] = False
+            self.__save_resource_meta(resource)
+        if resource is None or not resource.get('dual_primary'):
+            return connection_info
+
+        iqns = data.get('target_iqns') or [data.get('target_iqn')] * len(portals)
+        luns = data.get('target_luns') or [data.get('target_lun')] * len(portals)
+        for secondary_backend in self.configuration.replication_device:
+            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+            try:
+                peer_data = self._do_client_request(api_method='/initialize_connection', endpoint=endpoint,
+                                                    data={'volume_id': volume['id'], 'connector': connector})
+            except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                LOG.warning(f"The volume {volume['id']} is not exported by backend "
+                            f"{secondary_backend['backend_id']}, an exception occurred: {a.message}")
+                continue
+            if not isinstance(peer_data, dict):
+                LOG.warning(f"The volume {volume['id']} is not exported by backend "
+                            f"{secondary_backend['backend_id']}: {peer_data}")
+                continue
+            peer_portals = peer_data['target_portals']
+            portals += peer_portals
+            iqns += [peer_data['target_iqn']] * len(peer_portals)
+            luns += [peer_data['target_lun']] * len(peer_portals)
+            self.__add_portal_connections(volume['id'], connector, peer_portals)
+
+        data.update({'target_portals': portals, 'target_iqns': iqns, 'target_luns': luns})
+        LOG.info(f"The volume {volume['id']} is exported through {len(portals)} portals: {', '.join(portals)}")
+        return connection_info
+
+
+    @timed
     def remove_export(self, context, volume):
         self.target_driver.remove_export(context, volume)
+        self.__request_multipath_peers(volume, '/remove_export', {'volume_id': volume['id']})
+
+
+    def __request_multipath_peers(self, volume, api_method, data):
+        """
+        Sends the request to all secondary backends if the volume is a dual-primary resource
+        :param volume: cinder volume
+        :param api_method: the http request method
+        :param data: the data posted to backends
+        :return: None
+        """
+        resource = self.__load_resource_meta(volume['id'])
+        if resource is None or not resource.get('dual_primary'):
+            return
+        for secondary_backend in self.configuration.replication_device:
+            endpoint = self.__get_remote_backend_endpoint(secondary_backend)
+            try:
+                self._do_client_request(api_method=api_method, endpoint=endpoint, data=data)
+            except (ReplicatedVolumeBackendAPIException, ReplicatedVolumeBackendRetryableException) as a:
+                LOG.warning(f"The request {api_method} of volume {volume['id']} on backend "
+                            f"{secondary_backend['backend_id']} failed, an exception occurred: {a.message}")
+
+
+    def __add_portal_connections(self, volume_id, connector, portals):
+        """
+        Counts the connections of the initiator to the portals of the volume
+        :param volume_id: the volume id
+        :param connector: the connector
+        :param portals: list of portals
+        :return: None
+        """
+        with self._portal_lock:
+            self._portal_connections.update(portals)
+            self._connection_portals.setdefault((volume_id, (connector or {}).get('initiator')), []).extend(portals)
+
+
+    def __release_portal_connections(self, volume_id, connector):
+        """
+        Releases the portals counted for the connection of the initiator to the volume
+        :param volume_id: the volume id
+        :param connector: the connector
+        :return: None
+        """
+        with self._portal_lock:
+            portals = self._connection_portals.pop((volume_id, (connector or {}).get('initiator')), [])
+            self._portal_connections.subtract(portals)
+            for portal in set(portals):
+                if self._portal_connections[portal] <= 0:
+                    del self._portal_connections[portal]
+
+
+    def __set_unit_serial(self, volume):
+        """
+        Sets the unit serial of the LIO storage object of the dual-primary volume to the volume id, so all backends
+        report the same WWID and multipath aggregates their paths. LIO accepts the serial only while the storage
+        object is not linked to a LUN, so the LUN is relinked before initiators are added
+        :param volume: cinder volume
+        :return: None
+        """
+        iqn = f"{self.configuration.target_prefix}{volume['name']}"
+        storage_objects = glob.glob(f"{LIO_CONFIGFS}/core/*/{glob.escape(iqn)}")
+        if not storage_objects:
+            LOG.warning(f"The LIO storage object of volume {volume['id']} was not found, its unit serial is not set")
+            return
+        storage_object = storage_objects[0]
+        with open(f"{storage_object}/wwn/vpd_unit_serial") as file:
+            if file.read().strip().endswith(volume['id']):
+                return
+
+        links = [link for link in glob.glob(f"{LIO_CONFIGFS}/iscsi/{glob.escape(iqn)}/tpgt_*/lun/lun_*/*")
+                 if os.path.islink(link) and os.path.realpath(link) == os.path.realpath(storage_object)]
+        root_helper = utils.get_root_helper()
+        try:
+            for link in links:
+                self._execute('rm', link, root_helper=root_helper, run_as_root=True)
+            self._execute('tee', f"{storage_object}/wwn/vpd_unit_serial", process_input=volume['id'],
+                          root_helper=root_helper, run_as_root=True)
+            LOG.info(f"The unit serial of volume {volume['id']} was set for multipath access")
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to set the unit serial of volume {volume['id']}, error message was: {e.stderr}")
+        finally:
+            for link in links:
+                if not os.path.islink(link):
+                    self._execute('ln', '-s', storage_object, link, root_helper=root_helper, run_as_root=True)
+
+
+    def __get_portals(self) -> list:
+        """
+        Returns iscsi portals of the current backend
+        :return: list of portals
+        """
+        ips = [self.configuration.target_ip_address] + list(self.configuration.target_secondary_ip_addresses or [])
+        return [f"{ip}:{self.configuration.target_port}" for ip in ips]
+
+
+    def __export_replica(self, request):
+        """
+        Exports the dual-primary volume replica for multipath access. The replica is promoted only while it is
+        connected to all peers and up to date
+        :param request: the volume id and the connector
+        :return: portals, iqn and lun of the export
+        """
+        volume_id = request['volume_id']
+        resource = self.__load_resource_meta(volume_id)
+        if resource is None or not resource.get('dual_primary'):
+            raise ReplicatedVolumeBackendAPIException(data=f"The volume {volume_id} is not a dual-primary resource")
+        if not self.__is_replica_in_sync(volume_id):
+            raise ReplicatedVolumeBackendAPIException(data=f"The volume replica {volume_id} is not in sync")
+
+        ctxt = cinder_context.get_admin_context()
+        volume = objects.Volume.get_by_id(ctxt, volume_id)
+        self.__set_drbd_resource_primary(volume_id)
+        self.vg.activate_lv(volume.name)
+        self.target_driver.ensure_export(ctxt, volume, self.local_path(volume))
+        self.__set_unit_serial(volume)
+        connection_info = self.target_driver.initialize_connection(volume, request['connector'])
+
+        resource['multipath_exported'] = True
+        self.__save_resource_meta(resource)
+        self._multipath_exports.add(volume_id)
+        self.__start_multipath_fencing()
+        portals = self.__get_portals()
+        self.__add_portal_connections(volume_id, request['connector'], portals)
+        LOG.info(f"The volume replica {volume_id} was exported for multipath access")
+        return {
+            'target_portals': portals,
+            'target_iqn': connection_info['data']['target_iqn'],
+            'target_lun': connection_info['data']['target_lun'],
+        }
+
+
+    def __terminate_replica_connection(self, request):
+        """
+        Terminates the connection to the exported volume replica
+        :param request: the volume id and the connector
+        :return: empty result
+        """
+        ctxt = cinder_context.get_admin_context()
+        volume = objects.Volume.get_by_id(ctxt, request['volume_id'])
+        self.target_driver.terminate_connection(volume, request['connector'])
+        self.__release_portal_connections(request['volume_id'], request['connector'])
+        return {}
+
+
+    def __remove_replica_export(self, request):
+        """
+        Removes the export of the volume replica and demotes it to secondary
+        :param request: the volume id
+        :return: empty result
+        """
+        volume_id = request['volume_id']
+        ctxt = cinder_context.get_admin_context()
+        self.target_driver.remove_export(ctxt, objects.Volume.get_by_id(ctxt, volume_id))
+        resource = self.__load_resource_meta(volume_id)
+        if resource is not None:
+            resource.pop('multipath_exported', None)
+            self.__save_resource_meta(resource)
+        self._multipath_exports.discard(volume_id)
+        try:
+            root_helper = utils.get_root_helper()
+            self._execute('drbdadm', 'secondary', volume_id, root_helper=root_helper, run_as_root=True)
+        except processutils.ProcessExecutionError as e:
+            LOG.error(f"Failed to demote the volume replica {volume_id}, error message was: {e.stderr}")
+        LOG.info(f"The multipath export of volume replica {volume_id} was removed")
+        return {}
+
+
+    def __handle_snapshot_export(self, api_method, request):
+        """
+        Exports the snapshot replica taken for a backup
+        :param api_method: the api method
+        :param request: the snapshot id and the connector
+        :return: model update, connection info or empty result
+        """
+        ctxt = cinder_context.get_admin_context()
+        snapshot = objects.Snapshot.get_by_id(ctxt, request['snapshot_id'])
+        if api_method == '/create_snapshot_export':
+            self.vg.activate_lv(self._escape_snapshot(snapshot['name']), is_snapshot=True)
+            export_info = self.target_driver.create_export(ctxt, snapshot, super().local_path(snapshot))
+            LOG.info(f"The snapshot replica {snapshot['name']} was exported for backup")
+            return {'provider_location': export_info['location'],
+                    'provider_auth': export_info['auth'], }
+        if api_method == '/initialize_snapshot_connection':
+            return self.target_driver.initialize_connection(snapshot, request['connector'])
+        if api_method == '/terminate_snapshot_connection':
+            self.target_driver.terminate_connection(snapshot, request['connector'])
+        else:
+            self.target_driver.remove_export(ctxt, snapshot)
+            LOG.info(f"The export of snapshot replica {snapshot['name']} was removed")
+        return {}
+
+
+    def __is_replica_in_sync(self, resource_id) -> bool:
+        """
+        Checks that the local disk is up to date and all peers are connected and up to date
+        :param resource_id: drbd resource id
+        :return: true if the replica is in sync
+        """
+        for resource_status in self.__get_drbd_status(resource_id):
+            if any(d.get('disk-state') != 'UpToDate' for d in resource_status.get('devices', [])):
+                return False
+            connections = resource_status.get('connections', [])
+            return bool(connections) and all(
+                c.get('connection-state') == 'Connected' and
+                all(d.get('peer-disk-state') == 'UpToDate' for d in c.get('peer_devices', []))
+                for c in connections)
+        return False
+
+
+    def __start_multipath_fencing(self):
+        """
+        Starts the cleanup of multipath exports once the first volume replica is exported
+        :return: None
+        """
+        with self._multipath_lock:
+            if self._multipath_fencing:
+                return
+            self._multipath_fencing = True
+        self.__run_periodically(self.__fence_multipath_exports,
+                                self.configuration.replication_multipath_fence_interval)
+
+
+    def __fence_multipath_exports(self):
+        """
+        Removes multipath exports of volume replicas that lost the replication link or are no longer up to date,
+        so initiators continue on the paths of the primary backend only. The writes were already fenced by drbd
+        when the link was lost, this only cleans up the exports
+        :return: None
+        """
+        for volume_id in list(self._multipath_exports):
+            if self.__is_replica_in_sync(volume_id):
+                continue
+            LOG.warning(f"The volume replica {volume_id} is not in sync, its multipath export is removed")
+            try:
+                self.__remove_replica_export({'volume_id': volume_id})
+            except Exception as e:
+                LOG.error(f"Failed to remove the multipath export of volume replica {volume_id}, "
+                          f"an error occurred: {e}")
 
 
+    @timed
     def terminate_connection(self, volume, connector, **kwargs):
         def volume_provider_ips():
             backend_provider_ips = list()
@@ -731,6 +3654,11 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                                              a.connector['initiator'] == connector['initiator']) > 1:
                 return True
 
+        # the paths are torn down only when no other attachment of the initiator uses them
+        self.__request_multipath_peers(volume, '/terminate_connection',
+                                       {'volume_id': volume['id'], 'connector': connector})
+        self.__release_portal_connections(volume['id'], connector)
+
         self.target_driver.terminate_connection(volume, connector, **kwargs)
         return len(attachments) > 1
 
@@ -752,31 +3680,99 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                 'X-OVT-Resource-ID': resource_id}
 
 
-    @utils.retry(retry_tuple, interval=1, retries=3)
-    def _do_client_request(self, api_method, endpoint, data=None):
+    def _do_client_request(self, api_method, endpoint, data=None, http_method='POST', timeout=None, headers=None,
+                           idempotency_key=None, retry=True):
         """
-        Makes the http request to ev3 storage backend
+        Makes the http request to ev3 storage backend. All retries of the request carry the same idempotency key,
+        so the backend replays the stored response instead of repeating the operation
         :param api_method: the http request method
         :param endpoint: the endpoint
         :param data: the data posted to backend in json format
+        :param http_method: the http method
+        :param timeout: the request timeout in seconds
+        :param headers: additional headers signed with the request
+        :param idempotency_key: the idempotency key, a new one is generated if not specified
+        :param retry: false to send the request once, e.g. to a backend that may be down
         :return: the response from storage backend in json format, raise ReplicatedVolumeBackendRetryableException if
         response state code != 200
         """
+        headers = dict(headers or {})
+        headers[HTTP_HEADER_X_EV3_IDEMPOTENCY_KEY] = idempotency_key or str(uuid.uuid4())
+        if not retry:
+            return self.__send_request_once(api_method, endpoint, data, http_method, timeout, headers)
+        return self.__send_request(api_method, endpoint, data, http_method, timeout, headers)
+
+
+    @utils.retry(retry_tuple, interval=1, retries=5)
+    def __send_request(self, api_method, endpoint, data, http_method, timeout, headers):
+        """
+        Sends the signed http request to ev3 storage backend, connection errors and timeouts are retried
+        :param api_method: the http request method
+        :param endpoint: the endpoint
+        :param data: the data posted to backend in json format
+        :param http_method: the http method
+        :param timeout: the request timeout in seconds
+        :param headers: headers signed with the request
+        :return: the response from storage backend in json format
+        """
+        return self.__send_request_once(api_method, endpoint, data, http_method, timeout, headers)
+
+
+    def __send_request_once(self, api_method, endpoint, data, http_method, timeout, headers):
+        """
+        Sends the signed http request to ev3 storage backend
+        :param api_method: the http request method
+        :param endpoint: the endpoint
+        :param data: the data posted to backend in json format
+        :param http_method: the http method
+        :param timeout: the request timeout in seconds
+        :param headers: headers signed with the request
+        :return: the response from storage backend in json format
+        """
         if data is None:
             data = {}
 
-        headers = {}
-        self.signature.compute(access_key='',headers=headers, method='POST', path=api_method, parameters={}, body_content=json.dumps(data))
+        headers = dict(headers)
+        self.signature.compute(access_key='',headers=headers, method=http_method, path=api_method, parameters={}, body_content=json.dumps(data))
 
         try:
-            with requests.post(url=f"{endpoint}{api_method}", headers=headers, json=data) as resp:
-                if resp.status_code == 200:
+            with requests.request(http_method, url=f"{endpoint}{api_method}", headers=headers, json=data,
+                                  timeout=timeout) as resp:
+                if resp.status_code in (200, 202):
                     return resp.json()
                 else:
                     return resp.text
-        except requests.exceptions.ConnectionError as a:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as a:
             raise ReplicatedVolumeBackendRetryableException(data=str(a))
 
+    def _do_client_job(self, api_method, endpoint, data=None):
+        """
+        Requests a long-running operation from ev3 storage backend as a job and waits for its completion by
+        long-polling /jobs/<id>. The job id is kept for retries, so a retried request doesn't repeat the operation
+        :param api_method: the http request method
+        :param endpoint: the endpoint
+        :param data: the data posted to backend in json format
+        :return: the result of the operation, raise ReplicatedVolumeBackendAPIException if the operation failed
+        """
+        job_id = str(uuid.uuid4())
+        job = self._do_client_request(api_method=api_method, endpoint=endpoint, data=data,
+                                      headers={HTTP_HEADER_X_EV3_JOB_ID: job_id}, idempotency_key=job_id)
+        deadline = time.monotonic() + self.configuration.replication_job_timeout
+        poll_timeout = self.configuration.replication_job_poll_timeout
+        while isinstance(job, dict) and job.get('status') in (JOB_QUEUED, JOB_RUNNING):
+            if time.monotonic() > deadline:
+                raise ReplicatedVolumeBackendAPIException(data=f"The job {job_id} {api_method} was not finished "
+                                                               f"in {self.configuration.replication_job_timeout}s")
+            job = self._do_client_request(api_method=f"/jobs/{job_id}", endpoint=endpoint, http_method='GET',
+                                          timeout=poll_timeout + 30)
+
+        if not isinstance(job, dict):
+            raise ReplicatedVolumeBackendAPIException(data=job)
+        if job.get('status') == JOB_ERROR:
+            raise ReplicatedVolumeBackendAPIException(data=job.get('error'))
+        # backends without jobs answer synchronously
+        return job.get('result', job)
+
     """
         OVT ev3 Backend Server / OVT ev3 Restful API
     """
@@ -797,22 +3793,76 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
             return resp(environ, start_response)
         # end block: signature verification
 
+        idempotency_key = req.headers.get(HTTP_HEADER_X_EV3_IDEMPOTENCY_KEY)
+        if req.method != 'POST' or idempotency_key is None:
+            return self.__handle_request(req)(environ, start_response)
+
+        def handle():
+            r = self.__handle_request(req)
+            return r.status_code, list(r.headerlist), r.body
+
+        (status, headerlist, body), replayed = self._idempotency.get_or_run(
+            f"{req.path}:{idempotency_key}", handle, lambda r: 200 <= r[0] < 300)
+        if replayed:
+            LOG.info(f"The response to the request {req.path} with idempotency key {idempotency_key} was replayed")
+        resp = Response(status=status, headerlist=headerlist, body=body)
+        return resp(environ, start_response)
+
+
+    def __handle_request(self, req):
+        """
+        Handles the verified request
+        :param req: the request
+        :return: the response
+        """
+        resp = Response()
+        started = time.monotonic()
         try:
             if req.method == 'GET' and req.path == '/heartbeat':
                 resp.status_code = 200
-                resp.text = 'alive'
-            elif req.method == 'POST' and req.path == '/create_volume':
-                resource = req.json
-                self.__save_resource_meta(resource)
-                super()._create_volume(resource['volume_name'],
-                                       self._sizestr(resource['volume_size']),
-                                       self.configuration.lvm_type,
-                                       0)
-
-                self.__setup_drbd_config(resource)
+                resp.json = self.__get_heartbeat()
+            elif req.method == 'POST' and req.path in ('/create_volume', '/delete_volume', '/extend_volume',
+                                                       '/promote_volumes', '/demote_volumes',
+                                                       '/revert_to_snapshot', '/delete_volumes',
+                                                       '/bind_volume'):
+                handler = {
+                    '/create_volume': self.__create_replica,
+                    '/delete_volume': self.__delete_replica,
+                    '/extend_volume': self.__extend_replica,
+                    '/promote_volumes': lambda r: {'failed': self.__promote_resources(r['volume_ids'])},
+                    '/demote_volumes': lambda r: {'failed': self.__demote_resources(r['volume_ids'])},
+                    '/revert_to_snapshot': self.__revert_replicas,
+                    '/delete_volumes': self.__delete_replicas,
+                    '/bind_volume': self.__bind_replica,
+                }[req.path]
+                job_id = req.headers.get(HTTP_HEADER_X_EV3_JOB_ID)
+                if job_id is None:
+                    resp.status_code = 200
+                    resp.json = handler(req.json)
+                else:
+                    resp.status_code = 202
+                    resp.json = self._jobs.submit(job_id, handler, req.json)
+            elif req.method == 'POST' and req.path in ('/initialize_connection', '/terminate_connection',
+                                                       '/remove_export'):
+                handler = {
+                    '/initialize_connection': self.__export_replica,
+                    '/terminate_connection': self.__terminate_replica_connection,
+                    '/remove_export': self.__remove_replica_export,
+                }[req.path]
+                resp.status_code = 200
+                resp.json = handler(req.json)
+            elif req.method == 'POST' and req.path in ('/create_snapshot_export', '/initialize_snapshot_connection',
+                                                       '/terminate_snapshot_connection', '/remove_snapshot_export'):
                 resp.status_code = 200
-                resp.json = {}
-                LOG.info(f"The volume replica {resource['volume_id']} was successfully created")
+                resp.json = self.__handle_snapshot_export(req.path, req.json)
+            elif req.method == 'GET' and req.path.startswith('/jobs/'):
+                job = self._jobs.wait(req.path[len('/jobs/'):], self.configuration.replication_job_poll_timeout)
+                if job is None:
+                    resp.status_code = 404
+                    resp.text = 'Not Found'
+                else:
+                    resp.status_code = 200
+                    resp.json = job
             elif req.method == 'POST' and req.path == '/create_snapshot':
                 snapshot = req.json
                 self.vg.create_lv_snapshot(self._escape_snapshot(snapshot['name']),
@@ -821,18 +3871,6 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                 resp.status_code = 200
                 resp.json = {}
                 LOG.info(f"The volume snapshot replica {snapshot['name']} was successfully created")
-            elif req.method == 'POST' and req.path == '/delete_volume':
-                resource = req.json
-                self.__remove_drbd_config(resource)
-                self.__delete_resource_meta(resource)
-                volume = {
-                    'id': resource['volume_id'],
-                    'name': resource['volume_name']
-                }
-                super()._delete_volume(volume)
-                resp.status_code = 200
-                resp.json = {}
-                LOG.info(f"The volume replica {resource['volume_id']} was successfully deleted")
             elif req.method == 'POST' and req.path == '/delete_snapshot':
                 snapshot = req.json
                 message = f"The volume snapshot replica {snapshot['name']} was successfully deleted"
@@ -847,14 +3885,26 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
                     'message': message
                 }
                 LOG.info(message)
-            elif req.method == 'POST' and req.path == '/extend_volume':
-                resource = req.json
-                new_size = self._sizestr(resource['volume_size'])
-                self.vg.extend_volume(resource['volume_name'], self._sizestr(new_size))
-                resp.status_code = 200
-                resp.json = {}
-                message = f"The volume {resource['volume_id']} has been successfully extended up to {resource['volume_size']}G"
-                LOG.info(message)
+            elif req.method == 'POST' and req.path == '/admin/profile':
+                duration = (req.json if req.body else {}).get('duration',
+                                                              self.configuration.replication_profiler_duration)
+                path = self.__start_profiler(int(duration))
+                if path is None:
+                    resp.status_code = 409
+                    resp.text = 'The sampling profiler is already running'
+                else:
+                    resp.status_code = 202
+                    resp.json = {'profile': path, 'duration': int(duration)}
+            elif req.method == 'POST' and req.path == '/adjust_volumes':
+                resources = req.json['resources']
+                failed = [r['volume_id'] for r in resources if not self.__adjust_drbd_resource(r)]
+                if failed:
+                    resp.status_code = 500
+                    resp.text = f"Volume replicas {', '.join(failed)} were not adjusted"
+                else:
+                    resp.status_code = 200
+                    resp.json = {}
+                    LOG.info(f"{len(resources)} volume replicas were successfully adjusted")
             else:
                 resp.status_code = 404
                 resp.text = 'Not Found'
@@ -864,14 +3914,75 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         except Exception as e:
             resp.status_code = 500
             resp.text = f"An unexpected error occurred: {e}"
-        return resp(environ, start_response)
+        TIMERS.record(f"api {req.method} /{req.path.split('/')[1]}", time.monotonic() - started)
+        return resp
+
+
+    def __create_replica(self, resource):
+        """
+        Creates the volume replica requested by the primary backend
+        :param resource: resource object as dict
+        :return: empty result
+        """
+        self.__save_resource_meta(resource)
+        super()._create_volume(resource['volume_name'],
+                               self._sizestr(resource['volume_size']),
+                               self.configuration.lvm_type,
+                               0)
+
+        self.__account_capacity(resource['volume_size'], volumes=1)
+
+        self.__setup_drbd_config(resource)
+        LOG.info(f"The volume replica {resource['volume_id']} was successfully created")
+        return {}
+
+
+    def __delete_replica(self, resource):
+        """
+        Deletes the volume replica requested by the primary backend
+        :param resource: resource object as dict
+        :return: empty result
+        """
+        self.__remove_drbd_config(resource)
+        self.__delete_resource_meta(resource)
+        volume = {
+            'id': resource['volume_id'],
+            'name': resource['volume_name'],
+            'size': resource.get('volume_size', 0),
+        }
+        if self._volume_not_present(volume['name']):
+            LOG.info(f"The volume replica {resource['volume_id']} is already deleted")
+            return {}
+        self._delete_volume(volume)
+        self.__account_capacity(-resource.get('volume_size', 0), volumes=-1)
+        LOG.info(f"The volume replica {resource['volume_id']} was successfully deleted")
+        return {}
+
+
+    def __extend_replica(self, resource):
+        """
+        Extends the volume replica requested by the primary backend
+        :param resource: resource object as dict
+        :return: empty result
+        """
+        new_size = self._sizestr(resource['volume_size'])
+        self.vg.extend_volume(resource['volume_name'], self._sizestr(new_size))
+        size = self.__update_resource_meta_size(resource['volume_id'], resource['volume_size'])
+        if size is not None:
+            self.__account_capacity(resource['volume_size'] - size)
+        message = f"The volume {resource['volume_id']} has been successfully extended up to {resource['volume_size']}G"
+        LOG.info(message)
+        return {}
 
 
     def listen(self):
+        self._jobs = JobQueue(workers=self.configuration.replication_job_workers,
+                              ttl=self.configuration.replication_job_ttl)
+
         def serve_forever(log: logging):
             port = self.configuration.backend_port
             address = self.configuration.backend_ip
-            with make_server(address, port, self.__call__) as httpd:
+            with make_server(address, port, self.__call__, server_class=ThreadingWSGIServer) as httpd:
                 # Serve requests forever
                 log.info(f'Storage agent is listing on port {port}')
                 httpd.serve_forever()
@@ -879,6 +3990,12 @@ class ReplicatedVolumeDriver(LVMVolumeDriver):
         thread.daemon = True
         thread.start()
 
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """
+    Serves every request in its own thread, so long-polled job requests don't block other requests
+    """
+    daemon_threads = True
+
 class EV3SignerForAuthorizationHeader(AbstractSignerForAuthorizationHeader):
     def __init__(self, secret_key):
         super().__init__(scheme='AWS4', region_name='MSK', service_name='ev3_storage', terminator='ev3_request')
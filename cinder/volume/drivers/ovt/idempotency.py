@@ -0,0 +1,77 @@
+# Copyright (c) 2021-2025 OVT LLC, https://www.ovtsolutions.ru
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+
+class IdempotencyCache:
+    """
+    Bounded and expiring cache of completed responses keyed by the idempotency key of the request. A request with
+    a known key gets the stored response, a request with the key of a running request waits for its completion
+    """
+    def __init__(self, size:int, ttl:int):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_run(self, key:str, func, cacheable):
+        """
+        Returns the stored response for the key or runs func and stores its response if it's cacheable
+        :param key: the idempotency key
+        :param func: the callable returning the response
+        :param cacheable: the callable that checks whether the response can be stored
+        :return: tuple of the response and true if the response was replayed from the cache
+        """
+        while True:
+            with self.lock:
+                self.__expire()
+                entry = self.entries.get(key)
+                owner = entry is None
+                if owner:
+                    entry = {'event': threading.Event(), 'response': None, 'expires_at': None}
+                    self.entries[key] = entry
+
+            if not owner:
+                entry['event'].wait()
+                if entry['response'] is not None:
+                    return entry['response'], True
+                # the first request failed and was not stored, so this one runs again
+                continue
+
+            response = None
+            try:
+                response = func()
+                return response, False
+            finally:
+                with self.lock:
+                    if response is not None and cacheable(response):
+                        entry['response'] = response
+                        entry['expires_at'] = time.monotonic() + self.ttl
+                        self.entries.move_to_end(key)
+                        completed = [k for k, v in self.entries.items() if v['response'] is not None]
+                        for k in completed[:max(len(self.entries) - self.size, 0)]:
+                            del self.entries[k]
+                    else:
+                        self.entries.pop(key, None)
+                entry['event'].set()
+
+    def __expire(self):
+        now = time.monotonic()
+        for key in [k for k, v in self.entries.items() if v['expires_at'] is not None and v['expires_at'] < now]:
+            del self.entries[key]
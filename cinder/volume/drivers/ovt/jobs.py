@@ -0,0 +1,110 @@
+# Copyright (c) 2021-2025 OVT LLC, https://www.ovtsolutions.ru
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import queue
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_ERROR = 'error'
+
+
+class JobQueue:
+    """
+    Runs long-running operations of the ev3 Restful API on worker threads and keeps their status, so the client
+    can poll the job and a retried request is mapped to the job that was already accepted
+    """
+    def __init__(self, workers:int, ttl:int):
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        for i in range(workers):
+            thread = threading.Thread(target=self.__work, name=f"ev3-job-worker-{i}")
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, job_id:str, task, *args) -> dict:
+        """
+        Queues the task unless a job with the same id is already known
+        :param job_id: the job id chosen by the client
+        :param task: the callable
+        :param args: the task arguments
+        :return: the job status
+        """
+        with self.lock:
+            self.__expire()
+            job = self.jobs.get(job_id)
+            if job is None:
+                job = {
+                    'job_id': job_id,
+                    'status': JOB_QUEUED,
+                    'result': None,
+                    'error': None,
+                    'finished_at': None,
+                    'event': threading.Event(),
+                }
+                self.jobs[job_id] = job
+                self.queue.put((job, task, args))
+            else:
+                LOG.info(f"The job {job_id} is already {job['status']}, the request is not queued again")
+            return self.__status(job)
+
+    def wait(self, job_id:str, timeout:float):
+        """
+        Waits until the job is finished or the timeout expires
+        :param job_id: the job id
+        :param timeout: timeout in seconds
+        :return: the job status or None if the job is unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job['event'].wait(timeout)
+        return self.__status(job)
+
+    def __work(self):
+        while True:
+            job, task, args = self.queue.get()
+            job['status'] = JOB_RUNNING
+            try:
+                job['result'] = task(*args)
+                job['status'] = JOB_DONE
+            except Exception as e:
+                LOG.error(f"The job {job['job_id']} failed, an error occurred: {e}")
+                job['error'] = str(e)
+                job['status'] = JOB_ERROR
+            finally:
+                job['finished_at'] = time.monotonic()
+                job['event'].set()
+                self.queue.task_done()
+
+    def __expire(self):
+        now = time.monotonic()
+        for job_id in [k for k, v in self.jobs.items()
+                       if v['finished_at'] is not None and now - v['finished_at'] > self.ttl]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def __status(job:dict) -> dict:
+        return {k: job[k] for k in ('job_id', 'status', 'result', 'error')}
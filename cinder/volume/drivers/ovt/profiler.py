@@ -0,0 +1,136 @@
+# Copyright (c) 2021-2025 OVT LLC, https://www.ovtsolutions.ru
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    # cinder-volume runs monkey patched, the sampler must be a real thread to see the running greenthread.
+    # sys._current_frames() only knows os threads, so a sample holds the greenthread that runs on each os thread,
+    # greenthreads that wait in the hub are not sampled and the profile shows where the cpu time goes
+    from eventlet import patcher
+    _threading = patcher.original('threading')
+    _time = patcher.original('time')
+except ImportError:
+    _threading = threading
+    _time = time
+
+PROFILE_DIR = 'ev3_profile'
+
+
+class Timers:
+    """
+    Wall-clock timers of the driver entry points: number of calls, total and maximum duration
+    """
+    def __init__(self):
+        self.lock = _threading.Lock()
+        self.timers = collections.defaultdict(lambda: {'calls': 0, 'total': 0.0, 'max': 0.0})
+
+    def record(self, name:str, elapsed:float):
+        with self.lock:
+            timer = self.timers[name]
+            timer['calls'] += 1
+            timer['total'] += elapsed
+            timer['max'] = max(timer['max'], elapsed)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {k: dict(v) for k, v in self.timers.items()}
+
+
+TIMERS = Timers()
+
+
+def timed(func):
+    """
+    Records the wall-clock time of every call of the decorated function
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            TIMERS.record(name, time.monotonic() - started)
+    return wrapper
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads for a fixed duration and writes them in the folded format of flame graphs
+    together with the entry point timers. Only the running greenthread of each os thread is sampled, waiting
+    greenthreads are covered by the entry point timers
+    """
+    def __init__(self, output_dir:str, interval:float):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.lock = _threading.Lock()
+        self.running = False
+
+    def start(self, duration:int):
+        """
+        Starts the sampling unless a session is already running. Nothing is logged, so it can be called from a
+        signal handler
+        :param duration: duration in seconds
+        :return: path of the folded stacks file or None if a session is already running
+        """
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        thread = _threading.Thread(target=self.__sample, args=(path, duration), name='ev3-profiler')
+        thread.daemon = True
+        thread.start()
+        return path
+
+    def __sample(self, path:str, duration:int):
+        # no logging here, the log handlers hold green locks that can't be taken from a real thread
+        stacks = collections.Counter()
+        me = _threading.get_ident()
+        try:
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != me:
+                        stacks[self.__fold(frame)] += 1
+                _time.sleep(self.interval)
+
+            with open(path, 'w') as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+            with open(f"{os.path.splitext(path)[0]}.timers.json", 'w') as file:
+                json.dump(TIMERS.snapshot(), file, indent=4)
+        finally:
+            with self.lock:
+                self.running = False
+
+    @staticmethod
+    def __fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
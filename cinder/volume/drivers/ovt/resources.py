@@ -2,7 +2,7 @@ RESOURCE_CONF = '''
 resource {resource_id} {{
     device minor {minor};
     protocol {protocol};
-    meta-disk internal;{backends}
+    meta-disk internal;{options}{backends}
 }}'''
 REPLICATION_PROTOCOLS = {'async': 'A', 'semi-sync': 'B', 'full-sync': 'C'}
 BACKEND = \
@@ -10,5 +10,50 @@ BACKEND = \
     floating {address}:{port} {{
         disk    {disk};
     }}"""
+MESH_RESOURCE_CONF = '''
+resource {resource_id} {{
+    device minor {minor};
+    meta-disk internal;{options}{hosts}{connections}
+}}'''
+MESH_HOST = \
+"""
+    on {hostname} {{
+        node-id {node_id};
+        disk    {disk};
+    }}"""
+MESH_CONNECTION = \
+"""
+    connection {{
+        host {host_a} address {address_a}:{port};
+        host {host_b} address {address_b}:{port};
+        net {{
+            protocol {protocol};{net_options}
+        }}
+    }}"""
+MESH_PATHS_CONNECTION = \
+"""
+    connection {{{paths}
+        net {{
+            protocol {protocol};{net_options}
+        }}
+    }}"""
+MESH_PATH = \
+"""
+        path {{
+            host {host_a} address {address_a}:{port};
+            host {host_b} address {address_b}:{port};
+        }}"""
+SECTION = \
+"""
+    {name} {{{section_options}
+    }}"""
+SECTION_OPTION = \
+"""
+        {name} {value};"""
+CONNECTION_OPTION = \
+"""
+            {name} {value};"""
 HTTP_HEADER_X_EV3_DATE='x-ev3-date'
 HTTP_HEADER_X_EV3_TOKEN='x-ev3-token'
+HTTP_HEADER_X_EV3_JOB_ID='x-ev3-job-id'
+HTTP_HEADER_X_EV3_IDEMPOTENCY_KEY='x-ev3-idempotency-key'